@@ -2,6 +2,7 @@
 from discord import app_commands, Interaction
 from discord.ext import commands
 import os
+import time
 
 
 async def setup(bot):
@@ -9,10 +10,24 @@ async def setup(bot):
 
 
 class CogManagement(commands.Cog):
+    ''' Cog Management
+            Commands for loading, unloading and reloading cogs while the bot is running.
+
+            Cogs can keep their in-memory state across a reload by defining export_state and import_state methods.
+            Before a reload, the cog's name is put in bot.state_handoff with no snapshot yet. Once the old instance's
+            cog_unload has finished its pending work, it should replace that with the snapshot from export_state.
+            The new instance of the cog should take the snapshot out of bot.state_handoff in cog_load and pass it to import_state.
+            If the reload fails, discord.py puts the previous version of the extension back, and that instance picks the snapshot up instead.
+            Whatever hasn't been picked up by the end of the reload is thrown away, so it can't go stale.
+    '''
+
     # TODO: See if there's any way to use the autocomplete feature for the cog names
     def __init__(self, bot):
         self.bot = bot
 
+        if not hasattr(bot, 'state_handoff'):
+            bot.state_handoff = {}
+
 
     @app_commands.command(name='reload-cog', description='Reloads a cog')
     @app_commands.default_permissions(administrator=True)
@@ -24,12 +39,27 @@ class CogManagement(commands.Cog):
             await interaction.edit_original_response(content=f'Cog {cog_name} does not exist')
             return
 
+        start_time = time.perf_counter()
+
+        # Ask every cog in the extension to snapshot its state when it's unloaded, so that the reloaded cogs can pick it up
+        handed_off = [name for name, cog in self.bot.cogs.items() if cog.__module__ == f'Cogs.{cog_name}' and hasattr(cog, 'export_state')]
+        for name in handed_off:
+            self.bot.state_handoff[name] = None
+
         try:
             await self.bot.reload_extension(f'Cogs.{cog_name}')
-            await interaction.edit_original_response(content=f'Cog {cog_name} reloaded')
+            picked_up = [name for name in handed_off if name not in self.bot.state_handoff]
+            reload_time = (time.perf_counter() - start_time) * 1000
+            await interaction.edit_original_response(content=f'Cog {cog_name} reloaded in {reload_time:.0f} ms' + (f', state handed off to {", ".join(picked_up)}' if picked_up else ''))
+        except commands.ExtensionNotLoaded:
+            await interaction.edit_original_response(content=f'Cog {cog_name} is not loaded')
         except Exception as e:
             print(f'Error reloading cog {cog_name}: {e}')
-            await interaction.edit_original_response(content=f'Error reloading cog {cog_name}: {e}')
+            await interaction.edit_original_response(content=f'Error reloading cog {cog_name}, the previous version is still loaded: {e}')
+        finally:
+            # Don't leave a snapshot around for a later load to pick up by mistake, whether the reload worked or not
+            for name in handed_off:
+                self.bot.state_handoff.pop(name, None)
 
 
     @app_commands.command(name='load-cog', description='Loads a cog')
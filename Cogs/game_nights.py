@@ -1,12 +1,24 @@
 #!/usr/bin/env python3
 import datetime
 from discord.ext import commands
-from discord import app_commands, Interaction, TextChannel, Role, Permissions, ButtonStyle
-from discord.ui import Button, View
+from discord import app_commands, Interaction, TextChannel, Role, Permissions, ButtonStyle, SelectOption, HTTPException, NotFound
+from discord.ui import Button, Select, View
+from discord.utils import format_dt, snowflake_time, utcnow
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from functools import lru_cache, partial
+import asyncio
+import copy
+import json
+import heapq
+import math
 import os
 import tomlkit
 import csv
 import random
+import sqlite3
+import time
 
 
 async def setup(bot):
@@ -28,8 +40,12 @@ class GuildSettings:
             - Game Night Max Suggestions (Default 3, must be greater than 0. If set to 0 an unlimited number of suggestions can be made)
             - Suggestion Retain Threshold (Default 2, if set to a negative number no suggestions will be retained)
             - The time that the last vote was started (defaults to the start of the epoch)
+            - The time that the last announcement was made (defaults to the start of the epoch)
+            - The time that the last game night reminder was sent (defaults to the start of the epoch)
+
+            The game night, vote, and announcement times are cron expressions.
     '''
-    def __init__(self, announcement_channel_id=None, vote_channel_id=None, announcement_role_id=None, vote_role_id=None, game_night_time=None, vote_time=None, announcement_time=None, max_suggestions=3, retain_threshold=2, last_vote_time=0):
+    def __init__(self, announcement_channel_id=None, vote_channel_id=None, announcement_role_id=None, vote_role_id=None, game_night_time=None, vote_time=None, announcement_time=None, max_suggestions=3, retain_threshold=2, last_vote_time=0, last_announcement_time=0, last_game_night_time=0):
         self.announcement_channel_id = announcement_channel_id
         self.vote_channel_id = vote_channel_id
         self.announcement_role_id = announcement_role_id
@@ -40,6 +56,8 @@ class GuildSettings:
         self.max_suggestions = max_suggestions
         self.retain_threshold = retain_threshold
         self.last_vote_time = datetime.datetime.fromtimestamp(last_vote_time)
+        self.last_announcement_time = datetime.datetime.fromtimestamp(last_announcement_time)
+        self.last_game_night_time = datetime.datetime.fromtimestamp(last_game_night_time)
         self.is_active = announcement_channel_id is not None
 
     # Used to convert the class to a dictionary
@@ -64,6 +82,10 @@ class GuildSettings:
             yield 'retain_threshold', self.retain_threshold
         if self.last_vote_time is not None:
             yield 'last_vote_time', self.last_vote_time.timestamp()
+        if self.last_announcement_time is not None:
+            yield 'last_announcement_time', self.last_announcement_time.timestamp()
+        if self.last_game_night_time is not None:
+            yield 'last_game_night_time', self.last_game_night_time.timestamp()
         # Is active is based on the announcement channel ID, so it is not needed
 
 
@@ -77,7 +99,7 @@ class Suggestion:
             - A time stamp of when the suggestion was made
 
             The class overrides the equality operator to allow for easy comparison of suggestions.
-            If the name of the games match, regardless of case, the suggestions are considered equal. 
+            If the name of the games match, regardless of case, spacing and hyphens, the suggestions are considered equal. 
     '''
 
     def __init__(self, name, user_id, timestamp):
@@ -86,10 +108,10 @@ class Suggestion:
         self.timestamp = timestamp
 
     def __eq__(self, other):
-        return self.name.lower() == other.name.lower()
+        return SuggestionStore.key(self.name) == SuggestionStore.key(other.name)
 
     def __hash__(self) -> int:
-        return hash(self.name.lower())
+        return hash(SuggestionStore.key(self.name))
 
     def __str__(self) -> str:
         return f'{self.name} (Suggested by <@{self.user_id}>)'
@@ -101,6 +123,1155 @@ class Suggestion:
         yield from (self.name, self.user_id, self.timestamp)
 
 
+class SuggestionStore:
+    ''' The suggestions for a single guild
+            Suggestions are indexed by their normalized name, and the number of suggestions made by each user is counted as they are added and removed.
+            This keeps adding, deduplicating and checking a user's suggestion limit from having to scan every suggestion.
+
+            Iterating over the store yields the suggestions in the order they were made.
+    '''
+
+    def __init__(self, suggestions=()):
+        self._suggestions = {}
+        self._user_counts = Counter()
+
+        for suggestion in suggestions:
+            self.add(suggestion)
+
+    @staticmethod
+    def key(name):
+        ''' Get the key that a game name is indexed by, names that only differ by case, spacing and hyphens share a key
+                Names with any other punctuation keep it in their key, since it can be what tells games apart, like "C#" and "C++"
+        '''
+        folded_name = name.casefold()
+        normalized_name = TitleIndex.normalize(name)
+        if normalized_name and normalized_name == ''.join(character for character in folded_name if not character.isspace() and character != '-'):
+            return normalized_name
+        return folded_name
+
+    def __contains__(self, name):
+        return self.key(name) in self._suggestions
+
+    def __len__(self):
+        return len(self._suggestions)
+
+    def __iter__(self):
+        return iter(self._suggestions.values())
+
+    def get(self, name):
+        ''' Get the suggestion for a game, or None if it hasn't been suggested '''
+        return self._suggestions.get(self.key(name))
+
+    def add(self, suggestion):
+        ''' Add a suggestion, returns False if the game has already been suggested '''
+        key = self.key(suggestion.name)
+        if key in self._suggestions:
+            return False
+
+        self._suggestions[key] = suggestion
+        self._user_counts[suggestion.user_id] += 1
+        return True
+
+    def remove(self, name):
+        ''' Remove the suggestion for a game, if there is one '''
+        suggestion = self._suggestions.pop(self.key(name), None)
+        if suggestion is not None:
+            self._user_counts[suggestion.user_id] -= 1
+            if self._user_counts[suggestion.user_id] == 0:
+                del self._user_counts[suggestion.user_id]
+
+    def count(self, user_id):
+        ''' Get the number of suggestions a user has made '''
+        return self._user_counts[user_id]
+
+    def rows(self):
+        ''' Get the suggestions as (name, user ID, timestamp) tuples, which is all the storage backends need to save them '''
+        return [tuple(suggestion) for suggestion in self._suggestions.values()]
+
+
+class TitleIndex:
+    ''' Trigram index of game names, used to find the known names that are closest to what a user has typed
+            Names are kept under their SuggestionStore.key, so "Among Us" and "among-us" are the same game but "C#" and "C++" are not.
+            Trigrams are taken from the lower case letters and digits of a name, so punctuation doesn't get in the way of a search.
+
+            Matches are scored by the share of trigrams they have in common with the query, with names that start with the query ranked first.
+            Only the names that share at least one trigram with the query are ever looked at, which keeps searches fast with thousands of names.
+    '''
+
+    def __init__(self, names=()):
+        self._names = {}
+        self._normalized_names = {}
+        self._postings = {}
+
+        for name in names:
+            self.add(name)
+
+    @staticmethod
+    def normalize(name):
+        ''' Reduce a name to the form its trigrams are taken from '''
+        return ''.join(character for character in name.casefold() if character.isalnum())
+
+    @staticmethod
+    def trigrams(normalized_name):
+        ''' Get the trigrams of a normalized name, padded so that short names and the start of names still have trigrams '''
+        padded = f'  {normalized_name} '
+        return {padded[i:i+3] for i in range(len(padded) - 2)}
+
+    def __len__(self):
+        return len(self._names)
+
+    def __iter__(self):
+        return iter(self._names.values())
+
+    def get(self, name):
+        ''' Get the indexed spelling of a name, or None if no name has the same key '''
+        return self._names.get(SuggestionStore.key(name))
+
+    def add(self, name):
+        ''' Add a name to the index, the first spelling of a name is the one that is kept '''
+        key = SuggestionStore.key(name)
+        normalized_name = self.normalize(name)
+        if not normalized_name or key in self._names:
+            return
+
+        self._names[key] = name
+        self._normalized_names[key] = normalized_name
+        for trigram in self.trigrams(normalized_name):
+            self._postings.setdefault(trigram, set()).add(key)
+
+    def search(self, query, limit=25):
+        ''' Get up to limit names that best match the query, an empty query gives the most recently added names '''
+        normalized_query = self.normalize(query)
+        if not normalized_query:
+            return list(reversed(self._names.values()))[:limit]
+
+        # Count the trigrams that every candidate shares with the query
+        query_trigrams = self.trigrams(normalized_query)
+        shared = Counter()
+        for trigram in query_trigrams:
+            shared.update(self._postings.get(trigram, ()))
+
+        def score(key):
+            normalized_name = self._normalized_names[key]
+            return (normalized_name.startswith(normalized_query), 2 * shared[key] / (len(query_trigrams) + len(normalized_name) + 1))
+
+        return [self._names[key] for key in heapq.nlargest(limit, shared, key=score)]
+
+
+class GameNightStats:
+    ''' Running totals of a guild's finished votes
+            Every finished vote is added to the totals as it is archived, so the stats never have to be recomputed from the archive:
+
+            - The number of votes that have finished
+            - For each game, keyed by SuggestionStore.key: how many votes it was on, how many it won, and the sum of its share of the votes cast
+            - For each user, the number of votes they took part in
+
+            The leaderboard of the most winning games is rebuilt whenever a vote is added, so looking it up is free.
+    '''
+
+    leaderboard_size = 5
+
+    def __init__(self, votes=0, titles=None, users=None):
+        self.votes = votes
+        self.titles = {}
+        self.users = {int(user_id): participations for user_id, participations in (users or {}).items()}
+
+        # Totals saved under an older form of the key are merged into the game they now belong to
+        for title_stats in (titles or {}).values():
+            key = SuggestionStore.key(title_stats['title'])
+            if key in self.titles:
+                for total in ('appearances', 'wins', 'vote_share'):
+                    self.titles[key][total] += title_stats[total]
+            else:
+                self.titles[key] = dict(title_stats)
+
+        self._update_leaderboard()
+
+    # Used to convert the class to a dictionary
+    def __iter__(self):
+        yield 'votes', self.votes
+        yield 'titles', self.titles
+        yield 'users', {str(user_id): participations for user_id, participations in self.users.items()}
+
+    def _update_leaderboard(self):
+        self.leaderboard = heapq.nlargest(self.leaderboard_size, self.titles.values(), key=lambda title_stats: (title_stats['wins'], title_stats['vote_share'] / title_stats['appearances']))
+
+    def add_vote(self, titles, tallies, ballots, winner):
+        ''' Add a finished vote to the totals '''
+        total_votes = sum(tallies)
+        self.votes += 1
+
+        for title, tally in zip(titles, tallies):
+            title_stats = self.titles.setdefault(SuggestionStore.key(title), {'title': title, 'appearances': 0, 'wins': 0, 'vote_share': 0.0})
+            title_stats['appearances'] += 1
+            title_stats['wins'] += title == winner
+            title_stats['vote_share'] += tally / total_votes if total_votes else 0.0
+
+        for user_id in ballots:
+            self.users[user_id] = self.users.get(user_id, 0) + 1
+
+        self._update_leaderboard()
+
+    def get(self, title):
+        ''' Get the totals for a game, or None if it has never been on a vote '''
+        return self.titles.get(SuggestionStore.key(title))
+
+
+class VoteLog:
+    ''' Append only vote log
+            Writing a guild's whole vote snapshot on every button press doesn't scale, so each vote is instead
+            appended to game_nights/votes/<guild_id>.log as a single "user_id,title_index,value" line.
+
+            - Each line records the new value of a vote rather than a toggle, so replaying a log on top of a
+              snapshot that already includes some of its lines gives the same result
+            - Lines are flushed as they are written, and fsynced in batches of sync_every lines or every sync_interval seconds
+            - Once a guild's log has compact_every lines, its votes are written to a fresh snapshot and the log is truncated
+    '''
+
+    def __init__(self, directory, sync_every=32, sync_interval=5, compact_every=256):
+        self.directory = directory
+        self.sync_every = sync_every
+        self.sync_interval = sync_interval
+        self.compact_every = compact_every
+        self._files = {}
+        self._entry_counts = {}
+        self._unsynced = 0
+        self._last_sync = time.monotonic()
+
+
+    def _path(self, guild_id):
+        return os.path.join(self.directory, f'{guild_id}.log')
+
+
+    def guild_ids(self):
+        ''' Get the IDs of all guilds that have a vote log '''
+        return [int(filename[:-4]) for filename in os.listdir(self.directory) if filename.endswith('.log')]
+
+
+    def replay(self, guild_id):
+        ''' Yield every (user_id, title_index, value) entry in a guild's log '''
+        if not os.path.exists(self._path(guild_id)):
+            return
+
+        count = 0
+        with open(self._path(guild_id), 'r') as f:
+            for line in f:
+                try:
+                    user_id, title_index, value = (int(field) for field in line.split(','))
+                except ValueError:
+                    # A crash part way through a write can leave a partial line at the end of the log
+                    continue
+                count += 1
+                yield user_id, title_index, value
+
+        self._entry_counts[guild_id] = count
+
+
+    def append(self, guild_id, user_id, title_index, value):
+        ''' Append a vote to a guild's log '''
+        if guild_id not in self._files:
+            self._files[guild_id] = open(self._path(guild_id), 'a+')
+
+            # Make sure a partial line left by a crash doesn't swallow the first new line
+            if self._files[guild_id].tell() > 0:
+                self._files[guild_id].seek(self._files[guild_id].tell() - 1)
+                if self._files[guild_id].read(1) != '\n':
+                    self._files[guild_id].write('\n')
+
+        f = self._files[guild_id]
+        f.write(f'{user_id},{title_index},{value}\n')
+        f.flush()
+
+        self._entry_counts[guild_id] = self._entry_counts.get(guild_id, 0) + 1
+        self._unsynced += 1
+
+        if self._unsynced >= self.sync_every or time.monotonic() - self._last_sync >= self.sync_interval:
+            self.sync()
+
+
+    def needs_compaction(self, guild_id):
+        ''' Check if a guild's log is long enough that it should be folded into a snapshot '''
+        return self._entry_counts.get(guild_id, 0) >= self.compact_every
+
+
+    def sync(self):
+        ''' Make sure all appended votes are on disk '''
+        for f in self._files.values():
+            os.fsync(f.fileno())
+
+        self._unsynced = 0
+        self._last_sync = time.monotonic()
+
+
+    def truncate(self, guild_id):
+        ''' Empty a guild's log, should only be called once its votes are in a snapshot '''
+        if guild_id in self._files:
+            self._files.pop(guild_id).close()
+
+        if os.path.exists(self._path(guild_id)):
+            open(self._path(guild_id), 'w').close()
+
+        self._entry_counts[guild_id] = 0
+
+
+    def close(self):
+        ''' Sync and close all open logs '''
+        self.sync()
+        for f in self._files.values():
+            f.close()
+        self._files = {}
+
+
+@contextmanager
+def atomic_write(path):
+    ''' Open a temporary file for writing, and move it over the given path once it has been completely written '''
+    with open(f'{path}.tmp', 'w') as f:
+        yield f
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(f'{path}.tmp', path)
+
+
+class WriteBehind:
+    ''' Write behind persistence manager
+            Changes are marked as dirty per kind of data and per guild instead of being saved straight away. A burst of
+            changes is merged into a single save of only the guilds that changed, once delay seconds have passed since
+            the first change. Anything still dirty is saved when the manager is closed.
+
+            Saves run on a single storage thread so that disk I/O never blocks the event loop. Jobs run one at a time
+            in the order they were submitted, so an older snapshot can never overwrite a newer one.
+
+            Savers are given as a dictionary of kind of data to a function that takes a list of guild IDs, copies
+            the data that needs to be saved, and returns a job that saves the copy.
+
+            If a save fails, its guilds are marked as dirty again so that the next flush retries them.
+    '''
+
+    # Returned in place of a job's result when the job raised an error
+    failed = object()
+
+    def __init__(self, savers, delay=2.0, close_attempts=3):
+        self.savers = savers
+        self.delay = delay
+        self.close_attempts = close_attempts
+        self._dirty = {kind: set() for kind in savers}
+        self._flush_task = None
+        self._closing = False
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='game-nights-storage')
+
+
+    def mark(self, kind, guild_id):
+        ''' Mark a guild's data as needing to be saved '''
+        self._dirty[kind].add(guild_id)
+
+        # While closing, close itself retries anything that is still dirty
+        if self._closing:
+            return
+
+        if self._flush_task is None or self._flush_task.done():
+            try:
+                self._flush_task = asyncio.get_running_loop().create_task(self._flush_later())
+            except RuntimeError:
+                # There's no event loop to wait on, so just save now
+                self.flush()
+
+
+    def is_dirty(self, kind, guild_id):
+        return guild_id in self._dirty[kind]
+
+
+    async def _flush_later(self):
+        await asyncio.sleep(self.delay)
+        self.flush()
+
+
+    def _run(self, job):
+        ''' Run a job on the storage thread, making sure that one failed save doesn't stop the rest '''
+        try:
+            return job()
+        except Exception as e:
+            print('Failed to save game night data')
+            print(f'  Error: {e}')
+            return self.failed
+
+
+    def submit(self, job, callback=None):
+        ''' Queue a job to run on the storage thread, the callback is called on the event loop with its result '''
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            result = self._run(job)
+            if callback is not None:
+                callback(result)
+            return
+
+        future = loop.run_in_executor(self._executor, self._run, job)
+        if callback is not None:
+            future.add_done_callback(lambda future: callback(future.result()))
+
+
+    async def run(self, job):
+        ''' Run a job on the storage thread and wait for its result, unlike submitted jobs any error is raised '''
+        return await asyncio.get_running_loop().run_in_executor(self._executor, job)
+
+
+    def _saved(self, kind, guild_ids, result):
+        ''' Mark the guilds from a failed save as dirty again, so that they are retried '''
+        if result is self.failed:
+            for guild_id in guild_ids:
+                self.mark(kind, guild_id)
+
+
+    def flush(self):
+        ''' Queue a save of everything that is dirty
+                Savers copy the data on the event loop, so if one raises, its guilds are marked as dirty again and retried later
+        '''
+        retry = False
+        for kind, guild_ids in self._dirty.items():
+            if guild_ids:
+                self._dirty[kind] = set()
+                guild_ids = sorted(guild_ids)
+
+                try:
+                    job = self.savers[kind](guild_ids)
+                except Exception as e:
+                    print(f'Failed to copy game night {kind} for saving')
+                    print(f'  Error: {e}')
+                    self._dirty[kind].update(guild_ids)
+                    retry = True
+                    continue
+
+                self.submit(job, partial(self._saved, kind, guild_ids))
+
+        # While closing, close itself retries anything that is still dirty
+        if retry and not self._closing:
+            try:
+                self._flush_task = asyncio.get_running_loop().create_task(self._flush_later())
+            except RuntimeError:
+                pass
+
+
+    async def close(self):
+        ''' Stop waiting, save everything that is dirty, and wait for all queued saves to finish
+                Failed saves are retried a few times, and anything that still couldn't be saved is reported
+        '''
+        self._closing = True
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            self._flush_task = None
+
+        for _ in range(self.close_attempts):
+            self.flush()
+
+            # Jobs run in order, so once an empty job has run everything before it is done
+            await asyncio.get_running_loop().run_in_executor(self._executor, lambda: None)
+
+            # Let the callbacks of the finished jobs mark any failed saves as dirty again
+            await asyncio.sleep(0)
+            if not any(self._dirty.values()):
+                break
+        else:
+            for kind, guild_ids in self._dirty.items():
+                if guild_ids:
+                    print(f'Gave up saving game night {kind} for guilds {", ".join(map(str, sorted(guild_ids)))}, their latest changes have been lost')
+
+        self._executor.shutdown()
+
+
+class CronSchedule:
+    ''' Cron style schedule
+            Parses a standard five field cron expression (minute, hour, day of month, month, day of week) once, and
+            finds the next time that matches it. Fields can be *, numbers, ranges (a-b), steps (*/n or a-b/n), or
+            comma separated lists of any of those. Day of week runs from 0 (Sunday) to 6, 7 is also accepted as Sunday.
+
+            As with cron, if both the day of month and day of week are restricted, a day matches if either one matches.
+    '''
+
+    fields = [('minute', 0, 59), ('hour', 0, 23), ('day', 1, 31), ('month', 1, 12), ('weekday', 0, 7)]
+
+    def __init__(self, expression):
+        self.expression = expression
+        parts = expression.split()
+        if len(parts) != len(self.fields):
+            raise ValueError(f'Cron expressions need {len(self.fields)} fields, but "{expression}" has {len(parts)}')
+
+        for (name, low, high), part in zip(self.fields, parts):
+            setattr(self, name, self._parse_field(part, low, high))
+
+        # Sunday can be written as either 0 or 7
+        if 7 in self.weekday:
+            self.weekday = (self.weekday - {7}) | {0}
+
+        self._any_day = parts[2] == '*'
+        self._any_weekday = parts[4] == '*'
+
+
+    @staticmethod
+    def _parse_field(field, low, high):
+        ''' Get the set of values that a single field matches '''
+        values = set()
+        for part in field.split(','):
+            part, _, step = part.partition('/')
+            step = int(step) if step else 1
+
+            if part == '*':
+                start, end = low, high
+            elif '-' in part:
+                start, end = (int(value) for value in part.split('-', 1))
+            else:
+                start = end = int(part)
+
+            if not low <= start <= end <= high or step < 1:
+                raise ValueError(f'"{field}" is out of the range {low}-{high}')
+
+            values.update(range(start, end + 1, step))
+
+        return values
+
+
+    def _matches_day(self, time):
+        # Python counts weekdays from Monday, cron counts from Sunday
+        day_matches = time.day in self.day
+        weekday_matches = (time.weekday() + 1) % 7 in self.weekday
+
+        if self._any_day or self._any_weekday:
+            return day_matches and weekday_matches
+        return day_matches or weekday_matches
+
+
+    def next_after(self, time):
+        ''' Get the first time after the given time that matches the schedule '''
+        time = time.replace(second=0, microsecond=0) + datetime.timedelta(minutes=1)
+
+        # Any schedule will match at least once in a few years, this is just to make sure that an impossible
+        # schedule (like the 31st of February) doesn't loop forever
+        limit = time + datetime.timedelta(days=366 * 5)
+
+        while time < limit:
+            if time.month not in self.month:
+                time = (time.replace(day=1, hour=0, minute=0) + datetime.timedelta(days=32)).replace(day=1)
+            elif not self._matches_day(time):
+                time = time.replace(hour=0, minute=0) + datetime.timedelta(days=1)
+            elif time.hour not in self.hour:
+                time = time.replace(minute=0) + datetime.timedelta(hours=1)
+            elif time.minute not in self.minute:
+                time += datetime.timedelta(minutes=1)
+            else:
+                return time
+
+        raise ValueError(f'The cron expression "{self.expression}" never matches')
+
+
+@lru_cache(maxsize=None)
+def parse_cron(expression):
+    ''' Parse a cron expression, each expression is only parsed once '''
+    return CronSchedule(expression)
+
+
+class Scheduler:
+    ''' Single task deadline scheduler
+            Keeps a min heap of (fire time, guild ID, kind) entries for every guild, and sleeps until the earliest one
+            instead of polling each guild. Scheduling a guild again replaces its old entry for that kind, old entries
+            are left in the heap and skipped when they reach the top.
+
+            The callback is a coroutine function that is called with the guild ID and kind when an entry fires.
+            Each guild's callbacks run one at a time, in the order their entries fired, so an event that depends on an
+            earlier one (like an announcement closing a vote) never runs alongside it. Different guilds still run at the same time.
+    '''
+
+    def __init__(self, callback):
+        self.callback = callback
+        self._heap = []
+        self._generations = {}
+        self._wakeup = asyncio.Event()
+        self._task = None
+        self._running = {}
+
+
+    def schedule(self, guild_id, kind, when):
+        ''' Schedule the callback for a guild at the given time, replacing any existing schedule of the same kind '''
+        generation = self._generations.get((guild_id, kind), 0) + 1
+        self._generations[(guild_id, kind)] = generation
+        heapq.heappush(self._heap, (when.timestamp(), generation, guild_id, kind))
+
+        # If this is the new earliest entry, the scheduler needs to recalculate how long it sleeps for
+        if self._heap[0][1:] == (generation, guild_id, kind):
+            self._wakeup.set()
+
+
+    def cancel(self, guild_id, kind):
+        ''' Cancel a guild's schedule of the given kind '''
+        self._generations[(guild_id, kind)] = self._generations.get((guild_id, kind), 0) + 1
+
+
+    def _is_current(self, entry):
+        _, generation, guild_id, kind = entry
+        return self._generations.get((guild_id, kind)) == generation
+
+
+    async def _run(self):
+        while True:
+            # Throw away anything that has been rescheduled or cancelled
+            while self._heap and not self._is_current(self._heap[0]):
+                heapq.heappop(self._heap)
+
+            self._wakeup.clear()
+
+            if not self._heap:
+                await self._wakeup.wait()
+                continue
+
+            delay = self._heap[0][0] - time.time()
+            if delay > 0:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            _, generation, guild_id, kind = heapq.heappop(self._heap)
+
+            # Callbacks run in their own tasks so that one slow guild doesn't hold up the others
+            task = asyncio.create_task(self._run_after(self._running.get(guild_id), guild_id, kind))
+            self._running[guild_id] = task
+            task.add_done_callback(partial(self._finished, guild_id))
+
+
+    async def _run_after(self, previous, guild_id, kind):
+        ''' Run the callback once the guild's previous callback has finished, whether or not it failed '''
+        if previous is not None:
+            await asyncio.wait([previous])
+        await self.callback(guild_id, kind)
+
+
+    def _finished(self, guild_id, task):
+        if self._running.get(guild_id) is task:
+            del self._running[guild_id]
+
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+
+class FileStorage:
+    ''' TOML and CSV game night storage
+            The original storage format for this cog:
+
+            - Settings for every guild are stored in game_nights/settings.toml
+            - Suggestions are stored in game_nights/suggestions/<guild_id>.csv
+            - Vote snapshots are stored in game_nights/votes/<guild_id>.csv, with the vote message IDs in game_nights/votes/<guild_id>.txt
+            - Votes made since the last snapshot are appended to game_nights/votes/<guild_id>.log
+            - Every title that has been on a vote is appended to game_nights/history/<guild_id>.txt
+            - Finished votes are appended to game_nights/archive/<guild_id>.jsonl, one JSON object per line, with their running totals in game_nights/archive/<guild_id>.toml
+
+            Every save method takes the cog's full state dictionaries, along with an optional list of guild IDs to only save those guilds.
+            Files are written to a temporary file first and then moved into place, so a crash can't leave a half written file behind.
+    '''
+
+    def __init__(self, directory='game_nights'):
+        self.directory = directory
+
+        # If the directories used by this storage do not exist, create them
+        for path in (directory, os.path.join(directory, 'votes'), os.path.join(directory, 'suggestions'), os.path.join(directory, 'history'), os.path.join(directory, 'archive')):
+            if not os.path.exists(path):
+                os.makedirs(path)
+
+        # Individual votes are appended to a log between vote snapshots
+        self._vote_log = VoteLog(os.path.join(directory, 'votes'))
+
+        # The keys of the titles in each guild's title history, so that titles are only appended once
+        self._title_history_keys = {}
+
+
+    def load_settings(self):
+        ''' Load settings from file '''
+        settings = {}
+        if not os.path.exists(os.path.join(self.directory, 'settings.toml')):
+            self.save_settings(settings)
+            return settings
+
+        with open(os.path.join(self.directory, 'settings.toml'), 'r') as f:
+            for guild_id, guild_settings in tomlkit.parse(f.read()).items():
+                settings[int(guild_id)] = GuildSettings(**guild_settings)
+
+        return settings
+
+
+    def save_settings(self, settings, guild_ids=None):
+        ''' Save settings to file, all guilds share one file so they are always all saved '''
+        settings = {str(guild_id): dict(guild_settings) for guild_id, guild_settings in settings.items()}
+        with atomic_write(os.path.join(self.directory, 'settings.toml')) as f:
+            f.write(tomlkit.dumps(settings))
+
+
+    def load_suggestions(self):
+        ''' Load suggestions from file '''
+        suggestions = {}
+
+        # Iterate over all files in the suggestions directory
+        for filename in os.listdir(os.path.join(self.directory, 'suggestions')):
+            # Skip non-csv files
+            if not filename.endswith('.csv'):
+                continue
+
+            # Load the suggestions for this guild, the first row is the header
+            with open(os.path.join(self.directory, 'suggestions', filename), 'r') as f:
+                reader = csv.reader(f)
+                next(reader)
+                suggestions[int(filename[:-4])] = SuggestionStore(Suggestion(*row) for row in reader)
+
+        return suggestions
+
+
+    def save_suggestions(self, suggestions, guild_ids=None):
+        ''' Save suggestions to file '''
+        for guild_id in list(suggestions) if guild_ids is None else guild_ids:
+            with atomic_write(os.path.join(self.directory, 'suggestions', f'{guild_id}.csv')) as f:
+                writer = csv.writer(f)
+                writer.writerow(['name', 'user_id', 'timestamp'])
+                writer.writerows(list(suggestion) for suggestion in suggestions[guild_id])
+
+
+    def load_votes(self):
+        ''' Load vote titles, votes and vote message IDs from file '''
+        vote_titles = {}
+        votes = {}
+        vote_messages = {}
+
+        for filename in os.listdir(os.path.join(self.directory, 'votes')):
+            # csv files are vote data files
+            if filename.endswith('.csv'):
+                guild_id = int(filename[:-4])
+
+                with open(os.path.join(self.directory, 'votes', filename), 'r') as f:
+                    reader = csv.reader(f)
+
+                    # The first row is the header, and contains the list of games that are being voted on
+                    vote_titles[guild_id] = next(reader)[1:]
+                    votes[guild_id] = {int(row[0]): [int(vote_count) for vote_count in row[1:]] for row in reader}
+
+            # txt files are vote message IDs
+            elif filename.endswith('.txt'):
+                with open(os.path.join(self.directory, 'votes', filename), 'r') as f:
+                    vote_messages[int(filename[:-4])] = [int(line) for line in f.readlines()]
+
+        # Replay any votes that were made since each guild's last snapshot
+        for guild_id in self._vote_log.guild_ids():
+            for user_id, title_index, value in self._vote_log.replay(guild_id):
+                if guild_id not in vote_titles or title_index >= len(vote_titles[guild_id]):
+                    continue
+
+                if user_id not in votes[guild_id]:
+                    votes[guild_id][user_id] = [0] * len(vote_titles[guild_id])
+                votes[guild_id][user_id][title_index] = value
+
+        return vote_titles, votes, vote_messages
+
+
+    def save_votes(self, vote_titles, votes, vote_messages, guild_ids=None):
+        ''' Save a snapshot of the votes to file, and empty the vote log '''
+        for guild_id in list(votes) if guild_ids is None else guild_ids:
+            with atomic_write(os.path.join(self.directory, 'votes', f'{guild_id}.csv')) as f:
+                writer = csv.writer(f)
+
+                # Write the header data
+                writer.writerow(['user_id', *vote_titles[guild_id]])
+
+                # Write the vote data
+                for user_id, vote_counts in votes[guild_id].items():
+                    writer.writerow([user_id, *vote_counts])
+
+            # The snapshot now includes everything in the log
+            self._vote_log.truncate(guild_id)
+
+            if guild_id in vote_messages:
+                with atomic_write(os.path.join(self.directory, 'votes', f'{guild_id}.txt')) as f:
+                    f.write('\n'.join(str(message_id) for message_id in vote_messages[guild_id]))
+
+
+    def load_title_history(self):
+        ''' Load the titles that have been on each guild's votes, oldest first '''
+        title_history = {}
+
+        for filename in os.listdir(os.path.join(self.directory, 'history')):
+            if not filename.endswith('.txt'):
+                continue
+
+            guild_id = int(filename[:-4])
+            with open(os.path.join(self.directory, 'history', filename), 'r') as f:
+                title_history[guild_id] = [line.rstrip('\n') for line in f if line.strip()]
+            self._title_history_keys[guild_id] = {SuggestionStore.key(title) for title in title_history[guild_id]}
+
+        return title_history
+
+
+    def record_titles(self, guild_id, titles):
+        ''' Add titles to a guild's title history, skipping any that are already in it '''
+        keys = self._title_history_keys.setdefault(guild_id, set())
+        new_titles = []
+        for title in titles:
+            if SuggestionStore.key(title) not in keys:
+                keys.add(SuggestionStore.key(title))
+                new_titles.append(title)
+
+        if new_titles:
+            with open(os.path.join(self.directory, 'history', f'{guild_id}.txt'), 'a') as f:
+                f.writelines(f'{title}\n' for title in new_titles)
+
+
+    def load_stats(self):
+        ''' Load the running totals of each guild's finished votes '''
+        stats = {}
+
+        for filename in os.listdir(os.path.join(self.directory, 'archive')):
+            if not filename.endswith('.toml'):
+                continue
+
+            with open(os.path.join(self.directory, 'archive', filename), 'r') as f:
+                stats[int(filename[:-5])] = GameNightStats(**tomlkit.parse(f.read()).unwrap())
+
+        return stats
+
+
+    def load_vote_archive(self):
+        ''' Load every finished vote, oldest first '''
+        vote_archive = {}
+
+        for filename in os.listdir(os.path.join(self.directory, 'archive')):
+            if not filename.endswith('.jsonl'):
+                continue
+
+            with open(os.path.join(self.directory, 'archive', filename), 'r') as f:
+                vote_archive[int(filename[:-6])] = [json.loads(line) for line in f if line.strip()]
+
+        return vote_archive
+
+
+    def archive_vote(self, guild_id, vote, stats):
+        ''' Append a finished vote to a guild's archive, and save the guild's updated totals '''
+        with open(os.path.join(self.directory, 'archive', f'{guild_id}.jsonl'), 'a') as f:
+            f.write(json.dumps(vote, separators=(',', ':')) + '\n')
+
+        with atomic_write(os.path.join(self.directory, 'archive', f'{guild_id}.toml')) as f:
+            f.write(tomlkit.dumps(dict(stats)))
+
+
+    def record_vote(self, guild_id, user_id, title_index, value):
+        ''' Record a single vote, returns True if the guild's votes should be snapshotted with save_votes '''
+        self._vote_log.append(guild_id, user_id, title_index, value)
+        return self._vote_log.needs_compaction(guild_id)
+
+
+    def close(self):
+        self._vote_log.close()
+
+
+class SqliteStorage:
+    ''' SQLite game night storage
+            Stores all game night state in game_nights/game_nights.db, using WAL mode. Every save is a single
+            transaction of row level upserts, so a crash part way through a save can't corrupt anything.
+
+            The first time the database is opened, any existing TOML and CSV files are imported into it.
+    '''
+
+    schema = '''
+        CREATE TABLE IF NOT EXISTS settings (
+            guild_id INTEGER PRIMARY KEY,
+            announcement_channel_id INTEGER,
+            vote_channel_id INTEGER,
+            announcement_role_id INTEGER,
+            vote_role_id INTEGER,
+            game_night_time TEXT,
+            vote_time TEXT,
+            announcement_time TEXT,
+            max_suggestions INTEGER,
+            retain_threshold INTEGER,
+            last_vote_time REAL,
+            last_announcement_time REAL,
+            last_game_night_time REAL
+        );
+        CREATE TABLE IF NOT EXISTS suggestions (
+            guild_id INTEGER NOT NULL,
+            name_key TEXT NOT NULL,
+            name TEXT NOT NULL,
+            user_id INTEGER NOT NULL,
+            timestamp TEXT,
+            PRIMARY KEY (guild_id, name_key)
+        );
+        CREATE INDEX IF NOT EXISTS suggestions_user ON suggestions (guild_id, user_id);
+        CREATE TABLE IF NOT EXISTS vote_titles (
+            guild_id INTEGER NOT NULL,
+            title_index INTEGER NOT NULL,
+            title TEXT NOT NULL,
+            PRIMARY KEY (guild_id, title_index)
+        );
+        CREATE TABLE IF NOT EXISTS votes (
+            guild_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            title_index INTEGER NOT NULL,
+            value INTEGER NOT NULL,
+            PRIMARY KEY (guild_id, user_id, title_index)
+        );
+        CREATE TABLE IF NOT EXISTS vote_messages (
+            guild_id INTEGER NOT NULL,
+            position INTEGER NOT NULL,
+            message_id INTEGER NOT NULL,
+            PRIMARY KEY (guild_id, position)
+        );
+        CREATE TABLE IF NOT EXISTS title_history (
+            guild_id INTEGER NOT NULL,
+            name_key TEXT NOT NULL,
+            title TEXT NOT NULL,
+            PRIMARY KEY (guild_id, name_key)
+        );
+        CREATE TABLE IF NOT EXISTS vote_archive (
+            guild_id INTEGER NOT NULL,
+            vote TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS vote_archive_guild ON vote_archive (guild_id);
+        CREATE TABLE IF NOT EXISTS vote_stats (
+            guild_id INTEGER PRIMARY KEY,
+            votes INTEGER NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS title_stats (
+            guild_id INTEGER NOT NULL,
+            name_key TEXT NOT NULL,
+            title TEXT NOT NULL,
+            appearances INTEGER NOT NULL,
+            wins INTEGER NOT NULL,
+            vote_share REAL NOT NULL,
+            PRIMARY KEY (guild_id, name_key)
+        );
+        CREATE TABLE IF NOT EXISTS user_stats (
+            guild_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            participations INTEGER NOT NULL,
+            PRIMARY KEY (guild_id, user_id)
+        );
+    '''
+
+    settings_columns = ['announcement_channel_id', 'vote_channel_id', 'announcement_role_id', 'vote_role_id', 'game_night_time', 'vote_time', 'announcement_time', 'max_suggestions', 'retain_threshold', 'last_vote_time', 'last_announcement_time', 'last_game_night_time']
+
+    def __init__(self, directory='game_nights'):
+        self.directory = directory
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+
+        # Saves happen on the cog's storage thread, after the state has been loaded on the main thread
+        self._connection = sqlite3.connect(os.path.join(directory, 'game_nights.db'), check_same_thread=False)
+        self._connection.execute('PRAGMA journal_mode=WAL')
+        self._connection.execute('PRAGMA synchronous=NORMAL')
+
+        with self._connection:
+            self._connection.executescript(self.schema)
+
+            # Add any settings columns that were added after the database was created
+            existing_columns = {row[1] for row in self._connection.execute('PRAGMA table_info(settings)')}
+            for column in self.settings_columns:
+                if column not in existing_columns:
+                    self._connection.execute(f'ALTER TABLE settings ADD COLUMN {column} {"REAL" if column.startswith("last_") else "TEXT"}')
+
+        # The user version is used to record that the old files have been imported, and that names have been given their current keys
+        user_version = self._connection.execute('PRAGMA user_version').fetchone()[0]
+        if user_version == 0:
+            self._import_files()
+        if user_version < 2:
+            self._rekey_names()
+
+
+    def _import_files(self):
+        ''' Import the state saved by the file storage, if there is any '''
+        if os.path.exists(os.path.join(self.directory, 'settings.toml')):
+            print('Importing game night state from TOML and CSV files')
+            files = FileStorage(self.directory)
+            settings = files.load_settings()
+            suggestions = files.load_suggestions()
+            vote_titles, votes, vote_messages = files.load_votes()
+            title_history = files.load_title_history()
+            stats = files.load_stats()
+            vote_archive = files.load_vote_archive()
+            files.close()
+
+            self.save_settings(settings)
+            self.save_suggestions(suggestions)
+            self.save_votes(vote_titles, votes, vote_messages)
+            for guild_id, titles in title_history.items():
+                self.record_titles(guild_id, titles)
+            for guild_id, guild_stats in stats.items():
+                with self._connection:
+                    self._connection.executemany('INSERT INTO vote_archive (guild_id, vote) VALUES (?, ?)', [(guild_id, json.dumps(vote, separators=(',', ':'))) for vote in vote_archive.get(guild_id, [])])
+                    self._save_stats(guild_id, guild_stats, guild_stats.titles, guild_stats.users)
+
+        with self._connection:
+            self._connection.execute('PRAGMA user_version = 1')
+
+
+    def _rekey_names(self):
+        ''' Rewrite the suggestions, title history and game totals under the current SuggestionStore.key
+                Names used to be keyed by their case folded form, so games that only differ by spacing or hyphens are merged here,
+                instead of being counted twice once the new keys are upserted next to the old ones
+        '''
+        suggestions = self.load_suggestions()
+        title_history = self.load_title_history()
+        stats = self.load_stats()
+
+        with self._connection:
+            for table in ('title_history', 'title_stats'):
+                self._connection.execute(f'DELETE FROM {table}')
+
+        self.save_suggestions(suggestions)
+        for guild_id, titles in title_history.items():
+            self.record_titles(guild_id, titles)
+        for guild_id, guild_stats in stats.items():
+            with self._connection:
+                self._save_stats(guild_id, guild_stats, guild_stats.titles, [])
+
+        with self._connection:
+            self._connection.execute('PRAGMA user_version = 2')
+
+
+    def load_settings(self):
+        ''' Load settings from the database '''
+        settings = {}
+        for guild_id, *values in self._connection.execute(f'SELECT guild_id, {", ".join(self.settings_columns)} FROM settings'):
+            settings[guild_id] = GuildSettings(**{column: value for column, value in zip(self.settings_columns, values) if value is not None})
+        return settings
+
+
+    def save_settings(self, settings, guild_ids=None):
+        ''' Upsert the settings for some or all guilds '''
+        rows = []
+        for guild_id in list(settings) if guild_ids is None else guild_ids:
+            guild_settings = dict(settings[guild_id])
+            rows.append([guild_id, *(guild_settings.get(column) for column in self.settings_columns)])
+
+        updates = ', '.join(f'{column} = excluded.{column}' for column in self.settings_columns)
+        with self._connection:
+            self._connection.executemany(f'INSERT INTO settings (guild_id, {", ".join(self.settings_columns)}) VALUES ({", ".join("?" * (len(self.settings_columns) + 1))}) ON CONFLICT (guild_id) DO UPDATE SET {updates}', rows)
+
+
+    def load_suggestions(self):
+        ''' Load suggestions from the database '''
+        suggestions = {}
+        for guild_id, name, user_id, timestamp in self._connection.execute('SELECT guild_id, name, user_id, timestamp FROM suggestions'):
+            suggestions.setdefault(guild_id, SuggestionStore()).add(Suggestion(name, user_id, timestamp))
+        return suggestions
+
+
+    def save_suggestions(self, suggestions, guild_ids=None):
+        ''' Upsert the suggestions for some or all guilds, removing any that are no longer suggested '''
+        with self._connection:
+            for guild_id in list(suggestions) if guild_ids is None else guild_ids:
+                rows = [(guild_id, SuggestionStore.key(name), name, user_id, str(timestamp)) for name, user_id, timestamp in suggestions[guild_id]]
+
+                self._connection.execute(f'DELETE FROM suggestions WHERE guild_id = ? AND name_key NOT IN ({", ".join("?" * len(rows))})', [guild_id, *(row[1] for row in rows)])
+                self._connection.executemany('INSERT INTO suggestions (guild_id, name_key, name, user_id, timestamp) VALUES (?, ?, ?, ?, ?) ON CONFLICT (guild_id, name_key) DO UPDATE SET name = excluded.name, user_id = excluded.user_id, timestamp = excluded.timestamp', rows)
+
+
+    def load_votes(self):
+        ''' Load vote titles, votes and vote message IDs from the database '''
+        vote_titles = {}
+        votes = {}
+        vote_messages = {}
+
+        for guild_id, title in self._connection.execute('SELECT guild_id, title FROM vote_titles ORDER BY guild_id, title_index'):
+            vote_titles.setdefault(guild_id, []).append(title)
+
+        for guild_id in vote_titles:
+            votes[guild_id] = {}
+
+        for guild_id, user_id, title_index, value in self._connection.execute('SELECT guild_id, user_id, title_index, value FROM votes'):
+            if guild_id not in vote_titles or title_index >= len(vote_titles[guild_id]):
+                continue
+
+            if user_id not in votes[guild_id]:
+                votes[guild_id][user_id] = [0] * len(vote_titles[guild_id])
+            votes[guild_id][user_id][title_index] = value
+
+        for guild_id, message_id in self._connection.execute('SELECT guild_id, message_id FROM vote_messages ORDER BY guild_id, position'):
+            vote_messages.setdefault(guild_id, []).append(message_id)
+
+        return vote_titles, votes, vote_messages
+
+
+    def save_votes(self, vote_titles, votes, vote_messages, guild_ids=None):
+        ''' Replace the vote titles, votes and vote message IDs for some or all guilds '''
+        with self._connection:
+            for guild_id in list(votes) if guild_ids is None else guild_ids:
+                for table in ('vote_titles', 'votes', 'vote_messages'):
+                    self._connection.execute(f'DELETE FROM {table} WHERE guild_id = ?', (guild_id,))
+
+                self._connection.executemany('INSERT INTO vote_titles (guild_id, title_index, title) VALUES (?, ?, ?)', [(guild_id, index, title) for index, title in enumerate(vote_titles[guild_id])])
+                self._connection.executemany('INSERT INTO votes (guild_id, user_id, title_index, value) VALUES (?, ?, ?, ?)', [(guild_id, user_id, index, value) for user_id, values in votes[guild_id].items() for index, value in enumerate(values) if value])
+                self._connection.executemany('INSERT INTO vote_messages (guild_id, position, message_id) VALUES (?, ?, ?)', [(guild_id, position, message_id) for position, message_id in enumerate(vote_messages.get(guild_id, []))])
+
+
+    def load_title_history(self):
+        ''' Load the titles that have been on each guild's votes, oldest first '''
+        title_history = {}
+        for guild_id, title in self._connection.execute('SELECT guild_id, title FROM title_history ORDER BY rowid'):
+            title_history.setdefault(guild_id, []).append(title)
+        return title_history
+
+
+    def record_titles(self, guild_id, titles):
+        ''' Add titles to a guild's title history, skipping any that are already in it '''
+        with self._connection:
+            self._connection.executemany('INSERT INTO title_history (guild_id, name_key, title) VALUES (?, ?, ?) ON CONFLICT (guild_id, name_key) DO NOTHING', [(guild_id, SuggestionStore.key(title), title) for title in titles])
+
+
+    def load_stats(self):
+        ''' Load the running totals of each guild's finished votes '''
+        stats = {}
+
+        for guild_id, votes in self._connection.execute('SELECT guild_id, votes FROM vote_stats'):
+            stats[guild_id] = GameNightStats(votes)
+
+        titles = {}
+        for guild_id, name_key, title, appearances, wins, vote_share in self._connection.execute('SELECT guild_id, name_key, title, appearances, wins, vote_share FROM title_stats'):
+            titles.setdefault(guild_id, {})[name_key] = {'title': title, 'appearances': appearances, 'wins': wins, 'vote_share': vote_share}
+
+        users = {}
+        for guild_id, user_id, participations in self._connection.execute('SELECT guild_id, user_id, participations FROM user_stats'):
+            users.setdefault(guild_id, {})[user_id] = participations
+
+        return {guild_id: GameNightStats(guild_stats.votes, titles.get(guild_id), users.get(guild_id)) for guild_id, guild_stats in stats.items()}
+
+
+    def _save_stats(self, guild_id, stats, name_keys, user_ids):
+        ''' Upsert a guild's vote count, along with the totals for the given games and users '''
+        self._connection.execute('INSERT INTO vote_stats (guild_id, votes) VALUES (?, ?) ON CONFLICT (guild_id) DO UPDATE SET votes = excluded.votes', (guild_id, stats.votes))
+        self._connection.executemany('INSERT INTO title_stats (guild_id, name_key, title, appearances, wins, vote_share) VALUES (?, ?, ?, ?, ?, ?) ON CONFLICT (guild_id, name_key) DO UPDATE SET appearances = excluded.appearances, wins = excluded.wins, vote_share = excluded.vote_share',
+                                     [(guild_id, name_key, stats.titles[name_key]['title'], stats.titles[name_key]['appearances'], stats.titles[name_key]['wins'], stats.titles[name_key]['vote_share']) for name_key in name_keys])
+        self._connection.executemany('INSERT INTO user_stats (guild_id, user_id, participations) VALUES (?, ?, ?) ON CONFLICT (guild_id, user_id) DO UPDATE SET participations = excluded.participations',
+                                     [(guild_id, user_id, stats.users[user_id]) for user_id in user_ids])
+
+
+    def archive_vote(self, guild_id, vote, stats):
+        ''' Add a finished vote to a guild's archive, and upsert the totals it changed '''
+        with self._connection:
+            self._connection.execute('INSERT INTO vote_archive (guild_id, vote) VALUES (?, ?)', (guild_id, json.dumps(vote, separators=(',', ':'))))
+            self._save_stats(guild_id, stats, {SuggestionStore.key(title) for title in vote['titles']}, [int(user_id) for user_id in vote['ballots']])
+
+
+    def record_vote(self, guild_id, user_id, title_index, value):
+        ''' Upsert a single vote, the database never needs a separate snapshot '''
+        with self._connection:
+            self._connection.execute('INSERT INTO votes (guild_id, user_id, title_index, value) VALUES (?, ?, ?, ?) ON CONFLICT (guild_id, user_id, title_index) DO UPDATE SET value = excluded.value', (guild_id, user_id, title_index, value))
+        return False
+
+
+    def close(self):
+        self._connection.close()
+
+
 class GameNights(commands.Cog):
     ''' Game Nights
             This cog is for managing weekly game nights, and when fully implemented will
@@ -122,22 +1293,42 @@ class GameNights(commands.Cog):
             Votes will be taken using discord interaction buttons to prevent vote manipulation and will be saved in a CSV file, one file per server.
 
             Suggested games will be saved to a CSV file, one file per server, and will be loaded on start-up and saved whenever they are changed.
+
+            Setting GAME_NIGHTS_STORAGE=sqlite stores all of this in a single SQLite database instead.
     '''
 
     admin_group = app_commands.Group(name='game-night-admin', description='Admin commands for game nights', default_permissions=Permissions(administrator=True))
 
+    storage_backends = {'files': FileStorage, 'sqlite': SqliteStorage}
+
+    # Discord refuses to bulk delete messages older than two weeks, so leave a bit of margin
+    bulk_delete_max_age = datetime.timedelta(days=13, hours=23)
+    max_concurrent_deletes = 5
+
+    # Discord allows 25 options in a select menu and 5 rows of components in a message
+    vote_options_per_menu = 25
+    vote_menus_per_message = 5
+
+    # Scheduled events, and the settings that hold their cron expression and the last time they happened
+    scheduled_events = {
+        'vote': ('vote_time', 'last_vote_time'),
+        'announcement': ('announcement_time', 'last_announcement_time'),
+        'game_night': ('game_night_time', 'last_game_night_time'),
+    }
+
     def __init__(self, bot):
         self.bot = bot
 
-        # If the directories used by this cog do not exist, create them
-        if not os.path.exists('game_nights'):
-            os.makedirs('game_nights')
+        # The storage backend is opened on the storage thread when the cog is loaded
+        self._storage = None
+        self._load_task = None
 
-        if not os.path.exists(os.path.join('game_nights', 'votes')):
-            os.makedirs(os.path.join('game_nights', 'votes'))
-
-        if not os.path.exists(os.path.join('game_nights', 'suggestions')):
-            os.makedirs(os.path.join('game_nights', 'suggestions'))
+        # Changes are saved in the background, and only for the guilds that changed
+        self._persistence = WriteBehind({
+            'settings': self._settings_job,
+            'suggestions': self._suggestions_job,
+            'votes': self._votes_job,
+        })
 
         # All settings and state data is indexed by guild ID
         self._settings = {}
@@ -146,17 +1337,103 @@ class GameNights(commands.Cog):
         self._vote_titles = {}
         self._vote_messages = {}
 
-        # Load state from file
-        self._load_settings()
-        self._load_suggestions()
-        self._load_votes()
+        # Running vote totals and a title to index map, derived from the vote titles and votes
+        self._vote_tallies = {}
+        self._vote_title_indices = {}
+
+        # The views that are listening for votes on the vote messages
+        self._vote_views = {}
+
+        # Indices of every game name each guild has suggested or voted on, for autocompleting suggestions
+        self._title_indices = {}
+
+        # Running totals of each guild's finished votes
+        self._stats = {}
+
+        # Votes, announcements and game night reminders are triggered automatically for guilds that have set times for them
+        self._scheduler = Scheduler(self._handle_schedule)
+
+
+    async def cog_load(self):
+        # When the cog is reloaded, the previous instance hands over its state so that it doesn't have to be read back from storage
+        state = getattr(self.bot, 'state_handoff', {}).get(self.qualified_name)
+        if state is not None:
+            self.import_state(state)
+            del self.bot.state_handoff[self.qualified_name]
+
+        # State is loaded in the background, so that a lot of stored data doesn't hold up the bot starting
+        self._load_task = asyncio.create_task(self._load_state(handed_off=state is not None))
+
+
+    async def cog_unload(self):
+        # Let loading finish, so that nothing is saved over state that hasn't been read yet
+        if self._load_task is not None:
+            await asyncio.wait([self._load_task])
+
+        self._scheduler.stop()
+
+        # The views are registered with the bot, so they would otherwise outlive the cog
+        for guild_id in list(self._vote_views):
+            self._stop_vote_views(guild_id)
 
+        # Save anything that hasn't been saved yet
+        await self._persistence.close()
+        if self._storage is not None:
+            self._storage.close()
 
-    def __del__(self):
-        # Save everything to file
-        self._save_settings()
-        self._save_suggestions()
-        self._save_votes()
+        # Hand the state over if the cog is being reloaded, now that nothing else can change it
+        if self.qualified_name in getattr(self.bot, 'state_handoff', {}):
+            self.bot.state_handoff[self.qualified_name] = self.export_state()
+
+
+    def export_state(self):
+        ''' Snapshot the state as plain data, for a reloaded instance of the cog to pick up with import_state
+                Returns None if the state hasn't finished loading, in which case the new instance loads it from storage instead
+        '''
+        if self._load_task is None or not self._load_task.done() or self._load_task.cancelled() or self._load_task.exception() is not None:
+            return None
+
+        return {
+            'settings': {guild_id: dict(guild_settings) for guild_id, guild_settings in self._settings.items()},
+            'suggestions': {guild_id: suggestions.rows() for guild_id, suggestions in self._suggestions.items()},
+            'vote_titles': {guild_id: list(titles) for guild_id, titles in self._vote_titles.items()},
+            'votes': {guild_id: {user_id: list(user_votes) for user_id, user_votes in votes.items()} for guild_id, votes in self._votes.items()},
+            'vote_messages': {guild_id: list(message_ids) for guild_id, message_ids in self._vote_messages.items()},
+            'title_history': {guild_id: list(title_index) for guild_id, title_index in self._title_indices.items()},
+            'stats': {guild_id: dict(stats) for guild_id, stats in self._stats.items()},
+        }
+
+
+    def import_state(self, state):
+        ''' Pick up the state exported by a previous instance of the cog '''
+        self._settings = {guild_id: GuildSettings(**guild_settings) for guild_id, guild_settings in state['settings'].items()}
+        self._suggestions = {guild_id: SuggestionStore(Suggestion(*row) for row in rows) for guild_id, rows in state['suggestions'].items()}
+        self._vote_titles = state['vote_titles']
+        self._votes = state['votes']
+        self._vote_messages = state['vote_messages']
+        self._title_indices = {guild_id: TitleIndex(titles) for guild_id, titles in state['title_history'].items()}
+        self._stats = {guild_id: GameNightStats(**stats) for guild_id, stats in state['stats'].items()}
+
+        for guild_id in self._vote_titles:
+            self._index_votes(guild_id)
+
+
+    async def interaction_check(self, interaction: Interaction) -> bool:
+        ''' Hold off on running commands until state has been loaded, and refuse them if it couldn't be '''
+        try:
+            await asyncio.shield(self._load_task)
+        except Exception:
+            return False
+        return True
+
+
+    async def _component_check(self, interaction: Interaction) -> bool:
+        ''' The same check as interaction_check for the vote buttons and menus, which aren't covered by it, telling the user if it fails '''
+        if await self.interaction_check(interaction):
+            return True
+
+        await interaction.response.send_message('My scrolls are in disarray, young one. Try again later.', ephemeral=True)
+        return False
 
 
 
@@ -164,121 +1441,197 @@ class GameNights(commands.Cog):
     ######                STATE SAVE AND RESTORE METHODS                ######
     ##########################################################################
 
-    # TODO: Add arguments to the save methods to only save the data for a single guild
+    def _open_storage(self):
+        ''' Open the storage backend, this runs on the storage thread
+                The storage backend can be picked through the environment, and defaults to TOML and CSV files
+        '''
+        return self.storage_backends[os.getenv('GAME_NIGHTS_STORAGE', 'files')]()
 
-    def _load_settings(self):
-        ''' Load settings from file '''
-        if not os.path.exists(os.path.join('game_nights', 'settings.toml')):
-            self._settings = {}
-            self._save_settings()
-            return
 
-        with open(os.path.join('game_nights', 'settings.toml'), 'r') as f:
-            settings = tomlkit.parse(f.read())
+    def _load_storage(self):
+        ''' Open the storage backend and read state from it, this runs on the storage thread
+                Nothing is assigned to the cog here, the storage and state are picked up on the event loop once they have been read
+        '''
+        storage = self._open_storage()
+        vote_titles, votes, vote_messages = storage.load_votes()
 
-        for guild_id, guild_settings in settings.items():
-            self._settings[int(guild_id)] = GuildSettings(**guild_settings)
+        return storage, {
+            'settings': storage.load_settings(),
+            'suggestions': storage.load_suggestions(),
+            'vote_titles': vote_titles,
+            'votes': votes,
+            'vote_messages': vote_messages,
+            'title_history': storage.load_title_history(),
+            'stats': storage.load_stats(),
+        }
 
 
-    def _save_settings(self):
-        ''' Save settings to file '''
-        settings = {str(guild_id): dict(guild_settings) for guild_id, guild_settings in self._settings.items()}
-        with open(os.path.join('game_nights', 'settings.toml'), 'w') as f:
-            f.write(tomlkit.dumps(settings))
+    async def _load_state(self, handed_off=False):
+        ''' Load state in the background, then start everything that depends on it
+                If the state was handed off by a previous instance of the cog, only the storage backend has to be opened
+        '''
+        start_time = time.perf_counter()
 
+        try:
+            if handed_off:
+                self._storage = await self._persistence.run(self._open_storage)
+            else:
+                self._storage, state = await self._persistence.run(self._load_storage)
+        except Exception as e:
+            print('Failed to load game night data')
+            print(f'  Error: {e}')
+            raise
 
-    def _load_suggestions(self):
-        ''' Load suggestions from file '''
-        # Suggestions are stored in files named game_nights/suggestions/<guild_id>.txt
+        if not handed_off:
+            self._load_stored_state(state)
+        self._restore_vote_views()
 
-        # Iterate over all files in the suggestions directory
-        for filename in os.listdir(os.path.join('game_nights', 'suggestions')):
-            # Skip non-csv files
-            if not filename.endswith('.csv'):
-                continue
+        for guild_id in self._settings:
+            for kind in self.scheduled_events:
+                self._schedule(guild_id, kind, catch_up=True)
 
-            # Get the guild ID from the file name
-            guild_id = int(filename[:-4])
+        self._scheduler.start()
+        print(f'Loaded game night state in {(time.perf_counter() - start_time) * 1000:.0f} ms')
 
-            # Load the suggestions for this guild
-            with open(os.path.join('game_nights', 'suggestions', filename), 'r') as f:
-                # The first row is the header
-                reader = csv.reader(f)
-                next(reader)
-                self._suggestions[guild_id] = {Suggestion(*row) for row in reader}
 
+    def _load_stored_state(self, state):
+        ''' Pick up the state read from storage, along with everything derived from it '''
+        self._settings = state['settings']
+        self._suggestions = state['suggestions']
+        self._vote_titles = state['vote_titles']
+        self._votes = state['votes']
+        self._vote_messages = state['vote_messages']
+        self._stats = state['stats']
 
-    def _save_suggestions(self):
-        ''' Save suggestions to file '''
-        # Suggestions are stored in files named game_nights/suggestions/<guild_id>.txt
-        for guild_id, suggestions in self._suggestions.items():
-            with open(os.path.join('game_nights', 'suggestions', f'{guild_id}.csv'), 'w') as f:
-                writer = csv.writer(f)
-                writer.writerow(['name', 'user_id', 'timestamp'])
-                for suggestion in suggestions:
-                    writer.writerow(list(suggestion))
+        # A backend may have no rows at all for a guild with no suggestions or vote, which every guild has after a vote
+        for guild_id in self._settings:
+            self._suggestions.setdefault(guild_id, SuggestionStore())
+            self._votes.setdefault(guild_id, {})
+            self._vote_titles.setdefault(guild_id, [])
+            self._vote_messages.setdefault(guild_id, [])
 
+        for guild_id in self._vote_titles:
+            self._votes.setdefault(guild_id, {})
+            self._index_votes(guild_id)
 
-    def _load_votes(self):
-        ''' Load votes from file '''
+        self._load_title_indices(state['title_history'])
 
-        for filename in os.listdir(os.path.join('game_nights', 'votes')):
-            # csv files are vote data files
-            if filename.endswith('.csv'):
-                # Get the guild ID from the file name
-                guild_id = int(filename[:-4])
 
-                # Load the voting data for this guild
-                with open(os.path.join('game_nights', 'votes', filename), 'r') as f:
-                    reader = csv.reader(f)
+    def _save_settings(self, guild_id):
+        ''' Mark a guild's settings as needing to be saved '''
+        self._persistence.mark('settings', guild_id)
 
-                    # The first row is the header, and contains the list of games that are being voted on
-                    self._vote_titles[guild_id] = next(reader)[1:]
-                    self._votes[guild_id] = {}
 
-                    for row in reader:
-                        self._votes[guild_id][int(row[0])] = [int(vote_count) for vote_count in row[1:]]
-            
-            # txt files are vote message IDs
-            elif filename.endswith('.txt'):
-                # Get the guild ID from the file name
-                guild_id = int(filename[:-4])
+    def _settings_job(self, guild_ids):
+        ''' Copy the settings that need to be saved, and return a job that saves them '''
+        settings = {guild_id: copy.copy(guild_settings) for guild_id, guild_settings in self._settings.items()}
+        return partial(self._storage.save_settings, settings, guild_ids)
 
-                # Load the vote message ID for this guild
-                with open(os.path.join('game_nights', 'votes', filename), 'r') as f:
-                    self._vote_messages[guild_id] = [int(line) for line in f.readlines()]
 
+    def _save_suggestions(self, guild_id):
+        ''' Mark a guild's suggestions as needing to be saved '''
+        self._persistence.mark('suggestions', guild_id)
 
-    def _save_votes(self):
-        ''' Save votes to file '''
-        for guild_id, votes in self._votes.items():
-            with open(os.path.join('game_nights', 'votes', f'{guild_id}.csv'), 'w') as f:
-                writer = csv.writer(f)
 
-                # Write the header data
-                writer.writerow(['user_id', *self._vote_titles[guild_id]])
+    def _suggestions_job(self, guild_ids):
+        ''' Copy the suggestions that need to be saved, and return a job that saves them '''
+        suggestions = {guild_id: self._suggestions[guild_id].rows() for guild_id in guild_ids}
+        return partial(self._storage.save_suggestions, suggestions, guild_ids)
+
+
+    def _save_votes(self, guild_id):
+        ''' Mark a guild's votes as needing to be saved '''
+        self._persistence.mark('votes', guild_id)
+
+
+    def _votes_job(self, guild_ids):
+        ''' Copy the votes that need to be saved, and return a job that saves them '''
+        vote_titles = {guild_id: list(self._vote_titles[guild_id]) for guild_id in guild_ids}
+        votes = {guild_id: {user_id: list(user_votes) for user_id, user_votes in self._votes[guild_id].items()} for guild_id in guild_ids}
+        vote_messages = {guild_id: list(self._vote_messages[guild_id]) for guild_id in guild_ids if guild_id in self._vote_messages}
+        return partial(self._storage.save_votes, vote_titles, votes, vote_messages, guild_ids)
 
-                # Write the vote data
-                for user_id, vote_counts in votes.items():
-                    writer.writerow([user_id, *vote_counts])
 
-        for guild_id, message_ids in self._vote_messages.items():
-            with open(os.path.join('game_nights', 'votes', f'{guild_id}.txt'), 'w') as f:
-                f.write('\n'.join(str(message_id) for message_id in message_ids))
+    def _load_title_indices(self, title_history):
+        ''' Build the title indices from the title history, along with the current votes and suggestions '''
+        for guild_id in set(title_history) | set(self._vote_titles) | set(self._suggestions):
+            self._title_indices[guild_id] = TitleIndex(title_history.get(guild_id, []))
 
+            # Votes in progress may have started before there was a title history
+            if self._vote_titles.get(guild_id):
+                self._record_titles(guild_id, self._vote_titles[guild_id])
+
+            for suggestion in self._suggestions.get(guild_id, []):
+                self._title_indices[guild_id].add(suggestion.name)
+
+
+    def _archive_vote(self, guild_id, winner, tied_titles):
+        ''' Archive a guild's finished vote, and add it to the guild's running totals '''
+        titles = list(self._vote_titles[guild_id])
+        tallies = list(self._vote_tallies[guild_id])
+        ballots = {user_id: [index for index, vote in enumerate(user_votes) if vote] for user_id, user_votes in self._votes[guild_id].items() if any(user_votes)}
+
+        stats = self._stats.setdefault(guild_id, GameNightStats())
+        stats.add_vote(titles, tallies, ballots, winner)
+
+        vote = {
+            'finished_at': self._settings[guild_id].last_announcement_time.timestamp(),
+            'titles': titles,
+            'tallies': tallies,
+            'ballots': {str(user_id): indices for user_id, indices in ballots.items()},
+            'winner': winner,
+            'tied': tied_titles if len(tied_titles) > 1 else [],
+        }
+        self._persistence.submit(partial(self._storage.archive_vote, guild_id, vote, copy.deepcopy(stats)))
+
+
+    def _record_titles(self, guild_id, titles):
+        ''' Add titles to a guild's title history '''
+        for title in titles:
+            self._title_indices.setdefault(guild_id, TitleIndex()).add(title)
+
+        self._persistence.submit(partial(self._storage.record_titles, guild_id, list(titles)))
+
+
+    def _record_vote(self, guild_id, user_id, title_index):
+        ''' Save a single vote '''
+        # Votes are recorded against the vote titles, so any pending change to the titles has to be saved first
+        if self._persistence.is_dirty('votes', guild_id):
+            self._persistence.flush()
+
+        # A vote that failed to save is recovered by saving a full snapshot of the guild's votes instead
+        def compact(needs_snapshot):
+            if needs_snapshot is WriteBehind.failed or needs_snapshot:
+                self._save_votes(guild_id)
+
+        self._persistence.submit(partial(self._storage.record_vote, guild_id, user_id, title_index, self._votes[guild_id][user_id][title_index]), compact)
 
 
     ##########################################################################
     ######                        HELPER METHODS                        ######
     ##########################################################################
 
+    def _index_votes(self, guild_id):
+        ''' Rebuild the running vote tallies and the title index for a guild '''
+        titles = self._vote_titles[guild_id]
+        self._vote_title_indices[guild_id] = {title: index for index, title in enumerate(titles)}
+        self._vote_tallies[guild_id] = [sum(votes[index] for votes in self._votes[guild_id].values()) for index in range(len(titles))]
+
+
+    def _vote_results(self, guild_id):
+        ''' Get a list of (title, vote count) tuples for a guild's vote, sorted by vote count '''
+        results = list(zip(self._vote_titles[guild_id], self._vote_tallies[guild_id]))
+        results.sort(key=lambda result: result[1], reverse=True)
+        return results
+
+
     def _init_guild(self, guild):
         ''' Initialize a guild's settings '''
         if guild.id not in self._settings:
             self._settings[guild.id] = GuildSettings()
         
         if guild.id not in self._suggestions:
-            self._suggestions[guild.id] = []
+            self._suggestions[guild.id] = SuggestionStore()
 
         if guild.id not in self._votes:
             self._votes[guild.id] = {}
@@ -289,11 +1642,138 @@ class GameNights(commands.Cog):
         if guild.id not in self._vote_messages:
             self._vote_messages[guild.id] = []
 
-        self._save_settings()
-        self._save_suggestions()
-        self._save_votes()
+        self._index_votes(guild.id)
+
+        self._save_settings(guild.id)
+        self._save_suggestions(guild.id)
+        self._save_votes(guild.id)
+
+
+    def _parse_schedule(self, guild_id, kind):
+        ''' Parse a guild's cron expression for an event, returns None if the event isn't scheduled '''
+        expression = getattr(self._settings[guild_id], self.scheduled_events[kind][0])
+        return None if expression is None else parse_cron(expression)
+
+
+    def _schedule(self, guild_id, kind, catch_up=False):
+        ''' Schedule the next time that an event should happen for a guild, based on its cron expression
+                If catch_up is set and the event was missed (i.e. the bot was offline), it is scheduled for the time it was missed,
+                which has already passed, so it happens right away and in order with the guild's other missed events
+        '''
+        try:
+            schedule = self._parse_schedule(guild_id, kind)
+        except ValueError as e:
+            print(f'Invalid {kind} time for guild {guild_id}: {e}')
+            self._scheduler.cancel(guild_id, kind)
+            return
+
+        if schedule is None:
+            self._scheduler.cancel(guild_id, kind)
+            return
+
+        now = datetime.datetime.now()
+        last_time = getattr(self._settings[guild_id], self.scheduled_events[kind][1])
+        missed_time = schedule.next_after(last_time)
+
+        # Events that have never happened (last time at the start of the epoch) aren't caught up on
+        if catch_up and last_time.timestamp() > 0 and missed_time <= now and not self._missed_vote_closed(guild_id, kind, missed_time, now):
+            self._scheduler.schedule(guild_id, kind, missed_time)
+        else:
+            self._scheduler.schedule(guild_id, kind, schedule.next_after(now))
+
+
+    def _missed_vote_closed(self, guild_id, kind, missed_time, now):
+        ''' Check if a missed vote would also have been closed while the bot was offline
+                Catching up on it would start the vote and announce it straight away, before anyone could vote
+        '''
+        if kind != 'vote':
+            return False
+
+        try:
+            announcement_schedule = self._parse_schedule(guild_id, 'announcement')
+        except ValueError:
+            return False
+
+        return announcement_schedule is not None and announcement_schedule.next_after(missed_time) <= now
+
+
+    async def _handle_schedule(self, guild_id, kind):
+        ''' Trigger a scheduled event for a guild, and schedule the next one '''
+        await self.bot.wait_until_ready()
+
+        try:
+            if (guild := self.bot.get_guild(guild_id)) is None:
+                return
+
+            if kind == 'vote':
+                await self._start_vote(guild)
+            elif kind == 'announcement':
+                await self._announce(guild)
+            elif kind == 'game_night':
+                await self._remind_game_night(guild)
+        except Exception as e:
+            print(f'Failed to trigger scheduled {kind} for guild {guild_id}')
+            print(f'  Error: {e}')
+        finally:
+            # Make sure the event isn't caught up on again after a restart, even if it failed
+            setattr(self._settings[guild_id], self.scheduled_events[kind][1], datetime.datetime.now())
+            self._save_settings(guild_id)
+            self._schedule(guild_id, kind)
+
+
+    def _vote_channel(self, guild):
+        ''' Get the channel used for votes, which is the announcement channel unless a vote channel is set '''
+        vote_channel_id = self._settings[guild.id].vote_channel_id
+        if vote_channel_id is None:
+            vote_channel_id = self._settings[guild.id].announcement_channel_id
+        return guild.get_channel(vote_channel_id)
+
+
+    async def _start_vote(self, guild):
+        ''' Start a vote in a guild's vote channel '''
+        vote_role = guild.get_role(self._settings[guild.id].vote_role_id)
+        await self._create_vote(self._vote_channel(guild), vote_role, self._suggestions[guild.id])
+
+
+    async def _announce(self, guild):
+        ''' End the vote and make an announcement in a guild's announcement channel '''
+        announcement_channel = guild.get_channel(self._settings[guild.id].announcement_channel_id)
+        announcement_role = guild.get_role(self._settings[guild.id].announcement_role_id)
+        await self._create_announcement(announcement_channel, announcement_role)
+
+
+    async def _remind_game_night(self, guild):
+        ''' Let everyone know that game night is starting '''
+        announcement_channel = guild.get_channel(self._settings[guild.id].announcement_channel_id)
+        announcement_role = guild.get_role(self._settings[guild.id].announcement_role_id)
+        await announcement_channel.send(f'Gather round {announcement_role.mention if announcement_role is not None else "young ones"}, game night is about to begin!')
 
-        # TODO: set up an object to trigger announcements
+
+    async def _set_schedule(self, interaction, kind, schedule):
+        ''' Set the cron expression for one of a guild's scheduled events, an empty expression or "none" clears it '''
+        if interaction.guild_id not in self._settings:
+            await self._send_uninitialized_error(interaction)
+            return
+
+        name = kind.replace('_', ' ')
+        if schedule.strip().lower() in ('', 'none'):
+            schedule = None
+        else:
+            try:
+                next_time = parse_cron(schedule.strip()).next_after(datetime.datetime.now())
+            except ValueError as e:
+                await interaction.response.send_message(f'That is not a valid cron expression: {e}', ephemeral=True)
+                return
+            schedule = schedule.strip()
+
+        setattr(self._settings[interaction.guild.id], self.scheduled_events[kind][0], schedule)
+        self._save_settings(interaction.guild.id)
+        self._schedule(interaction.guild.id, kind)
+
+        if schedule is None:
+            await interaction.response.send_message(f'The {name} will no longer happen automatically', ephemeral=True)
+        else:
+            await interaction.response.send_message(f'The {name} time has been set to `{schedule}`, the next one will be at {format_dt(next_time.astimezone())}', ephemeral=True)
 
 
     async def _send_uninitialized_error(self, interaction):
@@ -309,12 +1789,7 @@ class GameNights(commands.Cog):
             return
 
         # Get a list of results that are tied for first place and choose a random one
-        votes = []
-
-        for index, title in enumerate(self._vote_titles[channel.guild.id]):
-            votes.append((title, sum(vote[index] for vote in self._votes[channel.guild.id].values())))
-
-        votes.sort(key=lambda vote: vote[1], reverse=True)
+        votes = self._vote_results(channel.guild.id)
         max_votes = votes[0][1]
         tied_games = [vote[0] for vote in votes if vote[1] == max_votes]
         game = random.choice(tied_games)
@@ -335,84 +1810,302 @@ class GameNights(commands.Cog):
             if vote_count >= self._settings[channel.guild.id].retain_threshold:
                 self._suggestions[channel.guild.id].add(Suggestion(title, 0, 0))
 
-        # Replace the vote view messages with a static message showing how many votes each game got
-        vote_channel = channel.guild.get_channel(self._settings[channel.guild.id].vote_channel_id)
-        first_message_id = self._vote_messages[channel.guild.id][0]
-        first_message = await vote_channel.fetch_message(first_message_id)
+        self._settings[channel.guild.id].last_announcement_time = datetime.datetime.now()
+        self._save_settings(channel.guild.id)
+        self._archive_vote(channel.guild.id, game, tied_games)
 
-        # Edit the message to contain the vote results
-        await first_message.edit(content='\n'.join(f'- {title} ({total_votes} {"vote" if total_votes == 1 else "votes"})' for title, total_votes in votes), view=None)
+        # Replace the vote view messages with a static message showing how many votes each game got
+        # Partial messages are enough to edit and delete, so nothing needs to be fetched first
+        vote_channel = self._vote_channel(channel.guild)
+        first_message = vote_channel.get_partial_message(self._vote_messages[channel.guild.id][0])
+        results = '\n'.join(f'- {title} ({total_votes} {"vote" if total_votes == 1 else "votes"})' for title, total_votes in votes)
 
-        # Delete all the other messages
-        for message_id in self._vote_messages[channel.guild.id][1:]:
-            message = await vote_channel.fetch_message(message_id)
-            await message.delete()
+        # Edit the first message to contain the vote results while all the other messages are deleted
+        await asyncio.gather(
+            first_message.edit(content=results, view=None),
+            self._delete_messages(vote_channel, self._vote_messages[channel.guild.id][1:])
+        )
 
         # Clear all the vote stuff
+        self._stop_vote_views(channel.guild.id)
         self._vote_titles[channel.guild.id] = []
         self._votes[channel.guild.id] = {}
         self._vote_messages[channel.guild.id] = []
+        self._index_votes(channel.guild.id)
+
+        self._save_suggestions(channel.guild.id)
+        self._save_votes(channel.guild.id)
+
+
+    async def _delete_messages(self, channel, message_ids):
+        ''' Deletes the given messages from a channel
+                Messages that are young enough are bulk deleted 100 at a time, the rest are deleted concurrently
+        '''
+        cutoff = utcnow() - self.bulk_delete_max_age
+        messages = [channel.get_partial_message(message_id) for message_id in message_ids]
+        young_messages = [message for message in messages if snowflake_time(message.id) > cutoff]
+        old_messages = [message for message in messages if snowflake_time(message.id) <= cutoff]
+
+        # Bulk deletion needs the manage messages permission, even for the bot's own messages
+        if young_messages and channel.permissions_for(channel.guild.me).manage_messages:
+            for i in range(0, len(young_messages), 100):
+                try:
+                    await channel.delete_messages(young_messages[i:i+100])
+                except HTTPException:
+                    old_messages.extend(young_messages[i:i+100])
+        else:
+            old_messages.extend(young_messages)
+
+        semaphore = asyncio.Semaphore(self.max_concurrent_deletes)
+
+        async def delete(message):
+            async with semaphore:
+                try:
+                    await message.delete()
+                except NotFound:
+                    pass
+
+        await asyncio.gather(*(delete(message) for message in old_messages))
+
+
+    def _vote_page_count(self, guild_id):
+        ''' Get the number of pages that the vote options are split across '''
+        if len(self._vote_titles[guild_id]) <= self.vote_options_per_menu * self.vote_menus_per_message:
+            return 1
+        return math.ceil(len(self._vote_titles[guild_id]) / (self.vote_options_per_menu * (self.vote_menus_per_message - 1)))
+
+
+    def _build_vote_view(self, guild_id, page, user_id, nonce, timeout=600):
+        ''' Build a user's private vote view for a page of the vote options
+                The options that the user has voted for are selected by default, so a menu's selection is always the user's full set of votes for its options.
+                Custom IDs hold the ID of the vote message, so that a view left open from an earlier vote can't vote in a later one.
+                They end with a nonce, so that an old view timing out never unregisters the components of a newer one.
+        '''
+        titles = self._vote_titles[guild_id]
+        vote_id = self._vote_id(guild_id)
+        user_votes = self._votes[guild_id].get(user_id, [])
+        page_count = self._vote_page_count(guild_id)
+
+        # Every menu on a page holds a range of option indices, and reserves a row for the page buttons if there is more than one page
+        page_size = self.vote_options_per_menu * (self.vote_menus_per_message - (page_count > 1))
+        view = View(timeout=timeout)
+
+        for menu_start in range(page * page_size, min(len(titles), (page + 1) * page_size), self.vote_options_per_menu):
+            indices = range(menu_start, min(menu_start + self.vote_options_per_menu, len(titles)))
+
+            menu = Select(
+                custom_id=f'game-night-vote:{vote_id}:{menu_start}:{page}:{nonce}',
+                placeholder=f'Games {indices[0] + 1}-{indices[-1] + 1}',
+                min_values=0,
+                max_values=len(indices),
+                options=[SelectOption(label=titles[index][:100], value=str(index), default=index < len(user_votes) and user_votes[index] == 1) for index in indices]
+            )
+            menu.callback = self._handle_vote
+            view.add_item(menu)
+
+        if page_count > 1:
+            previous_button = Button(style=ButtonStyle.secondary, label='Previous games', custom_id=f'game-night-vote-page:{page - 1}:{vote_id}:{nonce}', disabled=page == 0, row=self.vote_menus_per_message - 1)
+            next_button = Button(style=ButtonStyle.secondary, label='More games', custom_id=f'game-night-vote-page:{page + 1}:{vote_id}:{nonce}', disabled=page == page_count - 1, row=self.vote_menus_per_message - 1)
+            previous_button.callback = self._show_vote_page
+            next_button.callback = self._show_vote_page
+            view.add_item(previous_button)
+            view.add_item(next_button)
+
+        return view
+
+
+    def _vote_id(self, guild_id):
+        ''' Get the ID of the message for a guild's vote, which identifies the vote, or None if there's no vote '''
+        if not self._vote_titles.get(guild_id) or not self._vote_messages.get(guild_id):
+            return None
+        return self._vote_messages[guild_id][0]
+
+
+    async def _vote_over(self, interaction: Interaction) -> None:
+        ''' Tell a user that the vote they're trying to vote in is over, closing their private vote view if that's where they are '''
+        if interaction.message is not None and interaction.message.flags.ephemeral:
+            await interaction.response.edit_message(content='This vote is over, young one.', view=None)
+        else:
+            await interaction.response.send_message('This vote is over, young one.', ephemeral=True)
+
+
+    def _build_vote_message_view(self):
+        ''' Build the view for the vote message, a single button that opens a private vote view for whoever presses it '''
+        view = View(timeout=None)
+        button = Button(style=ButtonStyle.primary, label='Vote', custom_id='game-night-vote-page:0')
+        button.callback = self._show_vote_page
+        view.add_item(button)
+        return view
+
+
+    def _build_legacy_vote_views(self, titles):
+        ''' Build the per game button views that votes used to be sent with, one view per 25 titles
+                Votes that were started before the vote menus still have these buttons, so they are kept working until those votes end
+        '''
+        views = []
+        for title_sublist in (titles[i:i+25] for i in range(0, len(titles), 25)):
+            view = View(timeout=None)
+
+            for title in title_sublist:
+                button = Button(style=ButtonStyle.primary, label=title, custom_id=title)
+                button.callback = self._handle_legacy_vote
+                view.add_item(button)
+
+            views.append(view)
 
-        self._save_suggestions()
-        self._save_votes()
+        return views
+
+
+    def _restore_vote_views(self):
+        ''' Register the views for every vote in progress, so that the vote messages keep working after a restart
+                The views are rebuilt from the stored vote titles and message IDs, no messages are fetched or sent.
+                The layout of the messages isn't stored, so the old per game buttons are listened for as well.
+        '''
+        for guild_id, titles in self._vote_titles.items():
+            message_ids = self._vote_messages.get(guild_id, [])
+            if not titles or not message_ids:
+                continue
+
+            self._vote_views[guild_id] = [self._build_vote_message_view()]
+            self.bot.add_view(self._vote_views[guild_id][0], message_id=message_ids[0])
+
+            for view, message_id in zip(self._build_legacy_vote_views(titles), message_ids):
+                self.bot.add_view(view, message_id=message_id)
+                self._vote_views[guild_id].append(view)
+
+
+    def _stop_vote_views(self, guild_id):
+        ''' Stop listening for a guild's vote messages '''
+        for view in self._vote_views.pop(guild_id, []):
+            view.stop()
 
 
     async def _create_vote(self, channel, role, suggestions):
         ''' Creates a game night vote for the given suggestions '''
 
         # Clear the suggestions and transfer them to the vote titles list
+        self._stop_vote_views(channel.guild.id)
         self._vote_titles[channel.guild.id] = [suggestion.name for suggestion in suggestions]
         self._votes[channel.guild.id] = {}
         self._vote_messages[channel.guild.id] = []
-        self._suggestions[channel.guild.id] = set()
-        self._save_votes()
+        self._suggestions[channel.guild.id] = SuggestionStore()
+        self._index_votes(channel.guild.id)
+        self._save_votes(channel.guild.id)
+        self._record_titles(channel.guild.id, self._vote_titles[channel.guild.id])
+
+        # Send the whole vote as a single message, listing the options if they fit
+        content = (f'Hello {role.mention if role is not None else "young ones"}! The time has come to collect the votes for the next game night. Press the button below to pick the games you would like to play.\n'
+                   'When the vote is over, the game with the most votes will be announced. If there is a tie, I will consult the ancient scrolls to determine the winner.')
+        options = '\n**_Your Options:_**\n' + '\n'.join(f'- {title}' for title in self._vote_titles[channel.guild.id])
+        if len(content) + len(options) <= 2000:
+            content += options
+
+        self._vote_views[channel.guild.id] = [self._build_vote_message_view()]
+        vote_message = await channel.send(content, view=self._vote_views[channel.guild.id][0])
+        self._vote_messages[channel.guild.id].append(vote_message.id)
 
-        # Break the suggestions up into sub lists of 25
-        # Discord has a limit of 25 options per message
-        suggestion_sublists = [self._vote_titles[channel.guild.id][i:i+25] for i in range(0, len(suggestions), 25)]       
+        # Set the time that the last vote was started
+        self._settings[channel.guild.id].last_vote_time = datetime.datetime.now()
+        self._save_settings(channel.guild.id)
+        self._save_votes(channel.guild.id)
+        self._save_suggestions(channel.guild.id)
 
-        # TODO: You should probably make this all one message at some point. Doesn't really matter for now though
-        await channel.send(f'Hello {role.mention if role is not None else "young ones"}! The time has come to collect the votes for the next game night. Please select up to 3 of the games listed below by reacting to this message with the corresponding letter.')
-        await channel.send('When the vote is over, the game with the most votes will be announced. If there is a tie, I will consult the ancient scrolls to determine the winner.')
-        await channel.send('**_Your Options:_**')
 
-        # Create a vote message for each sub-list
-        for suggestion_sublist in suggestion_sublists:
-            view = View(timeout=None)
+    def _set_votes(self, guild_id, user_id, votes):
+        ''' Set a user's votes from a dictionary of title index to vote, recording the ones that changed '''
+        if user_id not in self._votes[guild_id]:
+            self._votes[guild_id][user_id] = [0] * len(self._vote_titles[guild_id])
 
-            for suggestion in suggestion_sublist:
-                button = Button(style=ButtonStyle.primary, label=suggestion, custom_id=suggestion)
-                button.callback = self._handle_vote
-                view.add_item(button)
+        for title_index, vote in votes.items():
+            if self._votes[guild_id][user_id][title_index] != vote:
+                self._votes[guild_id][user_id][title_index] = vote
+                self._vote_tallies[guild_id][title_index] += 1 if vote else -1
+                self._record_vote(guild_id, user_id, title_index)
 
-            view_message = await channel.send(view=view)
-            self._vote_messages[channel.guild.id].append(view_message.id)
 
-        # Set the time that the last vote was started
-        self._settings[channel.guild.id].last_vote_time = datetime.datetime.now()
-        self._save_settings()
-        self._save_votes()
-        self._save_suggestions()
+    def _vote_summary(self, guild_id, user):
+        ''' Describe the games a user has voted for '''
+        voted_titles = [title for title, vote in zip(self._vote_titles[guild_id], self._votes[guild_id].get(user.id, [])) if vote]
+        if voted_titles:
+            return f'Thank you young {user.mention}, your votes for {", ".join(voted_titles)} have been recorded.'
+        return f'You have not voted for any games yet, young {user.mention}.'
 
 
     async def _handle_vote(self, interaction: Interaction) -> None:
-        ''' Handle a vote '''
-        # Get the index of the game title in the title list
-        title_index = self._vote_titles[interaction.guild_id].index(interaction.data['custom_id'])
+        ''' Handle a vote from a user's private vote view
+                Each menu covers a range of option indices starting at the index in its custom ID. Its options start out selected
+                for the games the user has voted for, so the selected values are the full set of games the user wants from that range.
+        '''
+        if not await self._component_check(interaction):
+            return
+
+        guild_id = interaction.guild_id
+        vote_id, menu_start, page = (int(part) for part in interaction.data['custom_id'].split(':')[1:4])
+
+        if vote_id != self._vote_id(guild_id):
+            await self._vote_over(interaction)
+            return
+
+        # Work out which options the menu covers
+        indices = range(menu_start, min(menu_start + self.vote_options_per_menu, len(self._vote_titles[guild_id])))
+        selected = {int(value) for value in interaction.data.get('values', [])}
+
+        self._set_votes(guild_id, interaction.user.id, {title_index: 1 if title_index in selected else 0 for title_index in indices})
+
+        # Rebuild the view so that its defaults match the votes that were just recorded
+        view = self._build_vote_view(guild_id, page, interaction.user.id, interaction.id)
+        await interaction.response.edit_message(content=self._vote_summary(guild_id, interaction.user), view=view)
+
+
+    async def _handle_legacy_vote(self, interaction: Interaction) -> None:
+        ''' Handle a press of one of the per game vote buttons, which toggles the user's vote for that game '''
+        if not await self._component_check(interaction):
+            return
+
+        guild_id = interaction.guild_id
+        title = interaction.data['custom_id']
+
+        if title not in self._vote_title_indices.get(guild_id, {}):
+            await self._vote_over(interaction)
+            return
+
+        title_index = self._vote_title_indices[guild_id][title]
+        user_votes = self._votes[guild_id].get(interaction.user.id, [])
+        vote = 0 if title_index < len(user_votes) and user_votes[title_index] == 1 else 1
+        self._set_votes(guild_id, interaction.user.id, {title_index: vote})
+
+        if vote == 1:
+            await interaction.response.send_message(f'Thank you young {interaction.user.mention}, your vote for {title} has been recorded. Click the button again to remove your vote', ephemeral=True)
+        else:
+            await interaction.response.send_message(f'I have removed your vote for {title}, young {interaction.user.mention}.', ephemeral=True)
+
 
-        if interaction.user.id not in self._votes[interaction.guild_id]:
-            self._votes[interaction.guild_id][interaction.user.id] = [0] * len(self._vote_titles[interaction.guild_id])
+    async def _show_vote_page(self, interaction: Interaction) -> None:
+        ''' Show a user a page of their private vote view
+                Pressing the button on the vote message opens the view, and pressing a page button on the view flips its page
+        '''
+        if not await self._component_check(interaction):
+            return
 
-        # Toggle the vote
-        self._votes[interaction.guild_id][interaction.user.id][title_index] = 1 - self._votes[interaction.guild_id][interaction.user.id][title_index]
+        parts = interaction.data['custom_id'].split(':')
+        page = int(parts[1])
 
-        self._save_votes()
+        # The button on the vote message only holds the page, its vote is the message it's on
+        vote_id = int(parts[2]) if len(parts) > 2 else interaction.message.id
 
-        # Check to see if the new value is 1 or 0
-        if self._votes[interaction.guild_id][interaction.user.id][title_index] == 1:
-            await interaction.response.send_message(f'Thank you young {interaction.user.mention}, your vote for {interaction.data["custom_id"]} has been recorded. Click the button again to remove your vote', ephemeral=True)
+        if vote_id != self._vote_id(interaction.guild_id) or not 0 <= page < self._vote_page_count(interaction.guild_id):
+            await self._vote_over(interaction)
+            return
+
+        view = self._build_vote_view(interaction.guild_id, page, interaction.user.id, interaction.id)
+        content = self._vote_summary(interaction.guild_id, interaction.user)
+        if self._vote_page_count(interaction.guild_id) > 1:
+            content += f' (page {page + 1} of {self._vote_page_count(interaction.guild_id)})'
+
+        if interaction.message is not None and interaction.message.flags.ephemeral:
+            await interaction.response.edit_message(content=content, view=view)
         else:
-            await interaction.response.send_message(f'I have removed your vote for {interaction.data["custom_id"]}, young {interaction.user.mention}.', ephemeral=True)
+            await interaction.response.send_message(content, view=view, ephemeral=True)
 
 
 
@@ -428,7 +2121,7 @@ class GameNights(commands.Cog):
             self._init_guild(interaction.guild)
 
         self._settings[interaction.guild.id].announcement_channel_id = channel.id
-        self._save_settings()
+        self._save_settings(interaction.guild.id)
 
         await interaction.response.send_message(f'Announcement channel set to {channel.mention}', ephemeral=True)
 
@@ -442,7 +2135,7 @@ class GameNights(commands.Cog):
             return
 
         self._settings[interaction.guild.id].announcement_role_id = role.id
-        self._save_settings()
+        self._save_settings(interaction.guild.id)
 
         await interaction.response.send_message(f'Announcement role set to {role.mention}', ephemeral=True)
 
@@ -454,16 +2147,22 @@ class GameNights(commands.Cog):
             await self._send_uninitialized_error(interaction)
             return
 
-        # Get the channel ID for the announcement channel
-        announcement_channel_id = self._settings[interaction.guild.id].announcement_channel_id
-        announcement_channel = interaction.guild.get_channel(announcement_channel_id)
+        await self._announce(interaction.guild)
+        await interaction.response.send_message('Announcement triggered', ephemeral=True)
+
 
-        # Get the role ID for the announcement role
-        announcement_role_id = self._settings[interaction.guild.id].announcement_role_id
-        announcement_role = interaction.guild.get_role(announcement_role_id)
+    @admin_group.command(name='set-announcement-time', description='Set when the vote ends and the game night announcement is made')
+    @app_commands.describe(schedule='A cron expression, e.g. "0 18 * * 4" for every Thursday at 6pm. Use "none" to only trigger announcements manually')
+    async def set_announcement_time(self, interaction: Interaction, schedule: str) -> None:
+        ''' Set when the vote ends and the game night announcement is made '''
+        await self._set_schedule(interaction, 'announcement', schedule)
 
-        await self._create_announcement(announcement_channel, announcement_role)
-        await interaction.response.send_message('Announcement triggered', ephemeral=True)
+
+    @admin_group.command(name='set-game-night-time', description='Set when game night starts, a reminder will be sent at this time')
+    @app_commands.describe(schedule='A cron expression, e.g. "0 20 * * 5" for every Friday at 8pm. Use "none" to disable the reminder')
+    async def set_game_night_time(self, interaction: Interaction, schedule: str) -> None:
+        ''' Set when game night starts '''
+        await self._set_schedule(interaction, 'game_night', schedule)
 
 
 
@@ -480,7 +2179,7 @@ class GameNights(commands.Cog):
             return
 
         self._settings[interaction.guild.id].vote_channel_id = channel.id
-        self._save_settings()
+        self._save_settings(interaction.guild.id)
 
         await interaction.response.send_message(f'Vote channel set to {channel.mention}', ephemeral=True)
 
@@ -494,7 +2193,7 @@ class GameNights(commands.Cog):
             return
 
         self._settings[interaction.guild.id].vote_role_id = role.id
-        self._save_settings()
+        self._save_settings(interaction.guild.id)
 
         await interaction.response.send_message(f'Vote role set to {role.mention}', ephemeral=True)
         
@@ -506,36 +2205,24 @@ class GameNights(commands.Cog):
             await self._send_uninitialized_error(interaction)
             return
 
-        # Get the channel ID for the vote channel
-        vote_channel_id = self._settings[interaction.guild.id].vote_channel_id
-        if vote_channel_id is None:
-            vote_channel_id = self._settings[interaction.guild.id].announcement_channel_id
-        vote_channel = interaction.guild.get_channel(vote_channel_id)
-
-        # Get the role ID for the vote role
-        vote_role_id = self._settings[interaction.guild.id].vote_role_id
-        vote_role = interaction.guild.get_role(vote_role_id)
+        await self._start_vote(interaction.guild)
 
-        suggestions = self._suggestions[interaction.guild.id]
+        await interaction.response.send_message('Vote triggered', ephemeral=True)
 
-        await self._create_vote(vote_channel, vote_role, suggestions)
 
-        await interaction.response.send_message('Vote triggered', ephemeral=True)
+    @admin_group.command(name='set-vote-time', description='Set when the vote for the next game night starts')
+    @app_commands.describe(schedule='A cron expression, e.g. "0 12 * * 1" for every Monday at noon. Use "none" to only trigger votes manually')
+    async def set_vote_time(self, interaction: Interaction, schedule: str) -> None:
+        ''' Set when the vote for the next game night starts '''
+        await self._set_schedule(interaction, 'vote', schedule)
 
 
     @admin_group.command(name='list-votes', description='Lists the number of votes for each of the games currently in the running')
     async def list_votes(self, interaction: Interaction) -> None:
         ''' Lists the number of votes for each of the games currently in the running '''
 
-        # Create a list of tuples of each title being voted for and the number of votes it has received
-        votes = []
-
-        for index, title in enumerate(self._vote_titles[interaction.guild.id]):
-            vote_count = sum(i[index] for i in self._votes[interaction.guild.id].values())
-            votes.append((title, vote_count))
-
-        # Sort the list by the number of votes
-        votes.sort(key=lambda x: x[1], reverse=True)
+        # Create a list of tuples of each title being voted for and the number of votes it has received, sorted by the number of votes
+        votes = self._vote_results(interaction.guild.id)
 
         # Create the message text
         message_text = 'Here are the current votes:\n'
@@ -545,7 +2232,35 @@ class GameNights(commands.Cog):
         await interaction.response.send_message(message_text, ephemeral=True)
 
 
-    # TODO: We probably want a command that will somehow re-initialize the vote messages if necessary
+    @app_commands.command(name='game-night-stats', description='Show how past game night votes have gone')
+    @app_commands.describe(game_name='A game to show the stats for, leave this out for the overall stats')
+    async def game_night_stats(self, interaction: Interaction, game_name: str = None) -> None:
+        ''' Show the stats for past game night votes, or for one game '''
+        stats = self._stats.get(interaction.guild_id)
+        if stats is None or stats.votes == 0:
+            await interaction.response.send_message('There have not been any game night votes yet, young one.', ephemeral=True)
+            return
+
+        if game_name is not None:
+            title_stats = stats.get(game_name)
+            if title_stats is None:
+                message_text = f'{game_name} has never been on a game night vote.'
+            else:
+                message_text = f'{title_stats["title"]} has been on {title_stats["appearances"]} {"vote" if title_stats["appearances"] == 1 else "votes"} and won {title_stats["wins"]} of them, '
+                message_text += f'with an average of {title_stats["vote_share"] / title_stats["appearances"]:.0%} of the votes cast.'
+        else:
+            message_text = f'There have been {stats.votes} game night {"vote" if stats.votes == 1 else "votes"}. The most chosen games are:\n'
+            for title_stats in stats.leaderboard:
+                message_text += f'  - {title_stats["title"]}: {title_stats["wins"]} {"win" if title_stats["wins"] == 1 else "wins"}, {title_stats["vote_share"] / title_stats["appearances"]:.0%} average vote share\n'
+            message_text += f'You have taken part in {stats.users.get(interaction.user.id, 0)} of them.'
+
+        await interaction.response.send_message(message_text, ephemeral=True)
+
+
+    @game_night_stats.autocomplete('game_name')
+    async def game_night_stats_autocomplete(self, interaction: Interaction, current: str) -> list[app_commands.Choice[str]]:
+        ''' Suggest the known games that best match what the user has typed so far '''
+        return await self.suggest_autocomplete(interaction, current)
 
 
     ##########################################################################
@@ -561,20 +2276,37 @@ class GameNights(commands.Cog):
             return
 
         if interaction.guild_id not in self._suggestions:
-            self._suggestions[interaction.guild.id] = []
+            self._suggestions[interaction.guild.id] = SuggestionStore()
+
+        # Use the known spelling of the game if it has been suggested before, so that different spellings don't end up on the ballot twice
+        if interaction.guild_id in self._title_indices:
+            game_name = self._title_indices[interaction.guild_id].get(game_name) or game_name
 
         # Check to make sure the user hasn't made too many suggestions already
-        num_suggestions = sum(suggestion.user_id == interaction.user.id for suggestion in self._suggestions[interaction.guild.id])
+        num_suggestions = self._suggestions[interaction.guild.id].count(interaction.user.id)
 
         if num_suggestions >= self._settings[interaction.guild.id].max_suggestions > 0:
-            response = f'I am sorry young {interaction.user.mention}, but you have already suggested {num_suggestions} games{"s" if num_suggestions != 1 else ""}. Please wait until after the voting starts to make any more suggestions.'
+            response = f'I am sorry young {interaction.user.mention}, but you have already suggested {num_suggestions} game{"s" if num_suggestions != 1 else ""}. Please wait until after the voting starts to make any more suggestions.'
+        elif game_name in self._suggestions[interaction.guild.id]:
+            response = f'{self._suggestions[interaction.guild.id].get(game_name).name} has already been suggested, young {interaction.user.mention}'
         else:
             response = f'Your suggestion to play {game_name} has been received, young {interaction.user.mention}'
             self._suggestions[interaction.guild.id].add(Suggestion(game_name, interaction.user.id, interaction.created_at))
-            self._save_suggestions()
+            self._title_indices.setdefault(interaction.guild.id, TitleIndex()).add(game_name)
+            self._save_suggestions(interaction.guild.id)
 
         await interaction.response.send_message(response, ephemeral=True)
 
+
+    @suggest.autocomplete('game_name')
+    async def suggest_autocomplete(self, interaction: Interaction, current: str) -> list[app_commands.Choice[str]]:
+        ''' Suggest the known games that best match what the user has typed so far '''
+        if interaction.guild_id not in self._title_indices:
+            return []
+
+        # Discord shows at most 25 choices, and names can't be longer than 100 characters
+        return [app_commands.Choice(name=title[:100], value=title[:100]) for title in self._title_indices[interaction.guild_id].search(current, 25)]
+
     
     @admin_group.command(name='list-suggestions', description='List all of the suggestions for the next game night')
     async def list_suggestions(self, interaction: Interaction) -> None:
@@ -602,8 +2334,8 @@ class GameNights(commands.Cog):
             await interaction.response.send_message('There are already no suggestions for the next game night', ephemeral=True)
             return
 
-        self._suggestions[interaction.guild.id] = []
-        self._save_suggestions()
+        self._suggestions[interaction.guild.id] = SuggestionStore()
+        self._save_suggestions(interaction.guild.id)
 
         await interaction.response.send_message('All suggestions have been cleared', ephemeral=True)
 
@@ -1,5 +1,6 @@
 #!/usr/bin/env python3
 from discord.ext import commands
+import math
 
 
 async def setup(bot):
@@ -10,7 +11,24 @@ class Ping(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
 
+    @staticmethod
+    def _format_latency(latency):
+        # Latency isn't known until the first heartbeat has been acknowledged
+        return f'{round(latency * 1000)} ms' if math.isfinite(latency) else 'unknown'
+
     @commands.command()
     async def ping(self, ctx):
-        latency = round(self.bot.latency * 1000)
-        await ctx.send(f'{latency} ms')
\ No newline at end of file
+        if not isinstance(self.bot, commands.AutoShardedBot):
+            await ctx.send(self._format_latency(self.bot.latency))
+            return
+
+        # Report every shard this process runs, along with how many guilds it is handling
+        guild_counts = {}
+        for guild in self.bot.guilds:
+            guild_counts[guild.shard_id] = guild_counts.get(guild.shard_id, 0) + 1
+
+        lines = [f'Average: {self._format_latency(self.bot.latency)}']
+        for shard_id, latency in sorted(self.bot.latencies):
+            this_shard = ' (this server)' if ctx.guild is not None and ctx.guild.shard_id == shard_id else ''
+            lines.append(f'Shard {shard_id}: {self._format_latency(latency)}, {guild_counts.get(shard_id, 0)} servers{this_shard}')
+        await ctx.send('\n'.join(lines))
\ No newline at end of file
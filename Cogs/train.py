@@ -1,16 +1,263 @@
 # This cog will gather and save training data for the automated AI model
 from discord.ext import commands
-from discord import Member
+from discord import Member, Object, HTTPException
+from discord.utils import snowflake_time
+from typing import Literal
+import tomlkit
+import asyncio
 import csv
 import os
 
+try:
+    import pyarrow
+    import pyarrow.ipc
+except ImportError:
+    pyarrow = None
+
+
 async def setup(bot):
     await bot.add_cog(Train(bot))
 
 
+class CsvExporter:
+    ''' Batched CSV writer for training data
+            The file isn't created until the first row is written, so empty channels don't leave empty files behind.
+
+            Message data is saved in the following format:
+            message id, guild name, channel name, timestamp, user id, user name, user nickname, message content, and message id of the message that was replied to
+    '''
+
+    header = ['message id', 'guild name', 'channel name', 'timestamp', 'user id', 'user name', 'user nickname', 'message content', 'reply id']
+    extension = '.csv'
+
+    def __init__(self, path, append=False):
+        self.path = path
+        self.append = append
+        self._file = None
+        self._writer = None
+
+    def write_rows(self, rows):
+        ''' Write a batch of rows to the file '''
+        if not rows:
+            return
+
+        if self._file is None:
+            self._file = open(self.path, 'a' if self.append else 'w')
+            self._writer = csv.writer(self._file)
+            if not self.append:
+                self._writer.writerow(self.header)
+
+        self._writer.writerows(rows)
+
+        # Make sure the rows are on disk before a checkpoint is recorded for them
+        self._file.flush()
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+class ArrowExporter:
+    ''' Batched columnar writer for training data
+            Exports are Arrow IPC datasets: a directory of .arrow files holding the same columns as the CSV export.
+            Each crawl writes a new part file, so incremental crawls append without rewriting earlier parts.
+
+            - IDs are stored as unsigned 64 bit integers and timestamps as epoch milliseconds
+            - Guild, channel and author name columns are dictionary encoded, so they aren't repeated on every row
+            - Buffers are uncompressed by default so exports can be memory mapped with zero copies, pass compression='zstd' or 'lz4' to trade that for smaller files
+
+            Use load_training_data to read an export back in.
+    '''
+
+    extension = '.arrow'
+    dictionary_columns = ('guild_name', 'channel_name', 'user_name', 'user_nickname')
+
+    def __init__(self, path, append=False, compression=None):
+        if pyarrow is None:
+            raise RuntimeError('pyarrow must be installed to export training data in the arrow format')
+
+        self.path = path
+        self.append = append
+        self.compression = compression
+        self._writer = None
+        self._dictionaries = {column: {} for column in self.dictionary_columns}
+
+        self.schema = pyarrow.schema([
+            ('message_id', pyarrow.uint64()),
+            ('guild_name', pyarrow.dictionary(pyarrow.int32(), pyarrow.string())),
+            ('channel_name', pyarrow.dictionary(pyarrow.int32(), pyarrow.string())),
+            ('timestamp', pyarrow.timestamp('ms', tz='UTC')),
+            ('user_id', pyarrow.uint64()),
+            ('user_name', pyarrow.dictionary(pyarrow.int32(), pyarrow.string())),
+            ('user_nickname', pyarrow.dictionary(pyarrow.int32(), pyarrow.string())),
+            ('message_content', pyarrow.string()),
+            ('reply_id', pyarrow.uint64()),
+        ])
+
+    def _open(self):
+        ''' Open a new part file, clearing out old parts first unless appending '''
+        if not os.path.exists(self.path):
+            os.makedirs(self.path)
+
+        parts = sorted(filename for filename in os.listdir(self.path) if filename.endswith('.arrow'))
+        if not self.append:
+            for filename in parts:
+                os.remove(os.path.join(self.path, filename))
+            parts = []
+
+        part_path = os.path.join(self.path, f'part-{len(parts):05d}.arrow')
+        options = pyarrow.ipc.IpcWriteOptions(compression=self.compression, emit_dictionary_deltas=True)
+        self._writer = pyarrow.ipc.new_file(part_path, self.schema, options=options)
+
+    def _encode(self, column, values):
+        ''' Dictionary encode a column, growing the dictionary so later batches can be written as deltas '''
+        dictionary = self._dictionaries[column]
+        indices = [dictionary.setdefault(value, len(dictionary)) for value in values]
+        return pyarrow.DictionaryArray.from_arrays(pyarrow.array(indices, pyarrow.int32()), pyarrow.array(list(dictionary), pyarrow.string()))
+
+    def write_rows(self, rows):
+        ''' Write a batch of rows, in the same layout as the CSV rows, to the file '''
+        if not rows:
+            return
+
+        if self._writer is None:
+            self._open()
+
+        columns = list(zip(*rows))
+        arrays = []
+        for field, values in zip(self.schema, columns):
+            if field.name in self._dictionaries:
+                arrays.append(self._encode(field.name, values))
+            elif field.name == 'reply_id':
+                arrays.append(pyarrow.array([value if value != '' else None for value in values], field.type))
+            else:
+                arrays.append(pyarrow.array(values, field.type))
+
+        self._writer.write_batch(pyarrow.RecordBatch.from_arrays(arrays, schema=self.schema))
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+
+
+def load_training_data(path):
+    ''' Load an arrow training data export as a single pyarrow table, memory mapping each part file '''
+    tables = []
+    for filename in sorted(os.listdir(path)):
+        if filename.endswith('.arrow'):
+            with pyarrow.memory_map(os.path.join(path, filename)) as source:
+                tables.append(pyarrow.ipc.open_file(source).read_all())
+    return pyarrow.concat_tables(tables, promote_options='default') if tables else None
+
+
+class CrawlCheckpoints:
+    ''' Per channel crawl checkpoints
+            Records the ID of the last message that was exported from each channel to each export file. Later
+            crawls only fetch messages after the checkpoint and append them to the same export, and an interrupted
+            crawl picks up after the last batch that made it to disk.
+
+            Checkpoints are stored in data/checkpoints.toml, indexed by channel ID and then by export filename.
+            Setting a checkpoint only changes it in memory, the file is rewritten on a worker thread when save is awaited.
+            Older checkpoint files held one checkpoint per channel, either as a {filename, last_message_id} table or a bare
+            message ID. Those are converted when they are loaded, and a bare message ID is used for the channel's CSV export.
+    '''
+
+    # Checkpoints that were saved without a filename apply to the channel's CSV export, whatever it is called
+    legacy_filename = '*.csv'
+
+    def __init__(self, path):
+        self.path = path
+        self._checkpoints = {}
+        self._dirty = False
+        self._save_lock = asyncio.Lock()
+        self._load()
+
+    def _load(self):
+        ''' Load checkpoints from file '''
+        if not os.path.exists(self.path):
+            return
+
+        with open(self.path, 'r') as f:
+            checkpoints = tomlkit.parse(f.read())
+
+        for channel_id, exports in checkpoints.items():
+            if not isinstance(exports, dict):
+                exports = {self.legacy_filename: exports}
+            elif 'filename' in exports and 'last_message_id' in exports:
+                exports = {exports['filename']: exports['last_message_id']}
+
+            self._checkpoints[int(channel_id)] = {filename: int(last_message_id) for filename, last_message_id in exports.items()}
+
+    def _write(self, checkpoints):
+        ''' Write checkpoints to file, replacing the old file in one step so a crash can't corrupt it '''
+        with open(f'{self.path}.tmp', 'w') as f:
+            f.write(tomlkit.dumps(checkpoints))
+        os.replace(f'{self.path}.tmp', self.path)
+
+    async def save(self):
+        ''' Save the checkpoints on a worker thread if any have changed, saves that overlap are merged into one after the other '''
+        async with self._save_lock:
+            if not self._dirty:
+                return
+
+            # Copy the checkpoints on the event loop, so that crawls can keep setting them while the copy is written
+            checkpoints = {str(channel_id): dict(exports) for channel_id, exports in self._checkpoints.items()}
+            self._dirty = False
+            try:
+                await asyncio.to_thread(self._write, checkpoints)
+            except Exception:
+                self._dirty = True
+                raise
+
+    def get(self, channel_id, filename):
+        ''' Get the last exported message ID for a channel, or None if it has to be crawled from the start '''
+        exports = self._checkpoints.get(channel_id, {})
+        last_message_id = exports.get(filename)
+        if last_message_id is None and filename.endswith('.csv'):
+            last_message_id = exports.get(self.legacy_filename)
+
+        # If the channel was renamed or the export was deleted, the crawl has to start over
+        if last_message_id is None or not os.path.exists(os.path.join('data', filename)):
+            return None
+
+        return last_message_id
+
+    def set(self, channel_id, filename, last_message_id):
+        ''' Record the last exported message ID for a channel '''
+        exports = self._checkpoints.setdefault(channel_id, {})
+        exports[filename] = last_message_id
+
+        # Once the CSV export has a checkpoint of its own, the old one is no longer needed
+        if filename.endswith('.csv'):
+            exports.pop(self.legacy_filename, None)
+
+        self._dirty = True
+
+    def discard(self, channel_id, filename):
+        ''' Forget a channel's checkpoint for an export '''
+        self._checkpoints.get(channel_id, {}).pop(filename, None)
+        self._dirty = True
+
+
 class Train(commands.Cog):
+    exporters = {'csv': CsvExporter, 'arrow': ArrowExporter}
+
     def __init__(self, bot):
         self.bot = bot
+        self._checkpoints = None
+
+        # Number of channels that are crawled at once, shared by every running crawl
+        self.crawl_concurrency = int(os.getenv('TRAIN_CRAWL_CONCURRENCY', 4))
+        self._crawl_semaphore = asyncio.Semaphore(self.crawl_concurrency)
+        self.max_crawl_retries = 5
+
+        # Checkpoints are saved at the end of every channel, and every this many batches while a channel is being crawled
+        self.checkpoint_interval = int(os.getenv('TRAIN_CHECKPOINT_INTERVAL', 10))
+
+        # Arrow exports are uncompressed unless a codec is picked through the environment
+        self.arrow_compression = os.getenv('TRAIN_ARROW_COMPRESSION') or None
 
         # TODO: I think these would be better used in postprocessing instead of preprocessing
         self._no_content_messages = [
@@ -32,83 +279,215 @@ class Train(commands.Cog):
             'something that is inappropriate for the present audience',
         ]
 
-    async def get_channel_messages(self, channel):
-        messages = []
-        async for message in channel.history(limit=None):
-            messages.append(message)
-        return messages
+    def _message_row(self, message):
+        ''' Convert a message into a row of training data '''
+        message_data = [message.id, message.guild.name, message.channel.name, message.created_at, message.author.id, message.author.name]
+
+        # Check to see if the user has a nickname, otherwise use their username
+        if type(message.author) is Member and message.author.nick is not None:
+            message_data.append(message.author.nick)
+        else:
+            message_data.append(message.author.name)
+
+        # Check to see if there is any content in the message
+        if message.content is not None:
+            message_data.append(message.content)
+        else:
+            message_data.append('')
+
+        # Check to see if the message is a reply to another message
+        if message.reference is not None:
+            message_data.append(message.reference.message_id)
+        else:
+            message_data.append('')
+
+        return message_data
+
+    @staticmethod
+    def export_name(channel):
+        ''' Get the name of a channel's export, discord allows channels with the same name so the guild and channel IDs are part of it '''
+        return f'{channel.guild.name}_{channel.name}_{channel.guild.id}_{channel.id}'
+
+    async def _move_legacy_export(self, channel, extension):
+        ''' Move a channel's export from before IDs were part of export names, so that its crawl can carry on from its checkpoint
+                Only the channel with a checkpoint for the old export gets it, a same named channel that crawled into it too starts over
+        '''
+        legacy_filename = f'{channel.guild.name}_{channel.name}{extension}'
+        filename = f'{self.export_name(channel)}{extension}'
+
+        last_message_id = self.checkpoints.get(channel.id, legacy_filename)
+        if last_message_id is None or os.path.exists(os.path.join('data', filename)):
+            return
+
+        os.replace(os.path.join('data', legacy_filename), os.path.join('data', filename))
+        self.checkpoints.set(channel.id, filename, last_message_id)
+        self.checkpoints.discard(channel.id, legacy_filename)
+        await self.checkpoints.save()
+
+    @property
+    def checkpoints(self):
+        ''' Crawl checkpoints, loaded the first time they are needed '''
+        if self._checkpoints is None:
+            # check to make sure that the data directory exists, and if not, create it
+            if not os.path.exists('data'):
+                os.makedirs('data')
+            self._checkpoints = CrawlCheckpoints(os.path.join('data', 'checkpoints.toml'))
+        return self._checkpoints
+
+    async def export_channel(self, channel, name, export_format='csv', batch_size=1000, progress=None, fresh=False):
+        ''' Stream a channel's history to an export file, oldest message first
+                Rows are written out in batches as the history is fetched, so memory use doesn't depend on the size
+                of the channel. The export format is either csv or arrow, and its extension is added to the name. If
+                the channel has been exported before, only the messages after its checkpoint are fetched and appended,
+                unless fresh is set. The optional progress coroutine is called with the running message count after
+                each batch. Returns the number of messages written.
+        '''
+        exporter_type = self.exporters[export_format]
+        filename = f'{name}{exporter_type.extension}'
 
-    async def save_message_data_csv(self, messages, filename):
         # check to make sure that the data directory exists, and if not, create it
         if not os.path.exists('data'):
             os.makedirs('data')
-        
-        # message data will be saved in the following format:
-        # message id, guild name, channel name, timestamp, user id, user name, user nickname, message content, and message id of the message that was replied to
-        # Make sure the messages are sorted from oldest to newest
-        messages.sort(key=lambda message: message.created_at)
-
-        with open(os.path.join('data', filename), 'w') as f:
-            writer = csv.writer(f)
-            writer.writerow(['message id', 'guild name', 'channel name', 'timestamp', 'user id', 'user name', 'user nickname', 'message content', 'reply id'])
-            for message in messages:
+
+        # Crawled messages are also fed to the wisdoms cog's message locator
+        wisdoms = self.bot.get_cog('Wisdoms')
+
+        checkpoint = None if fresh else self.checkpoints.get(channel.id, filename)
+        after = Object(id=checkpoint) if checkpoint is not None else None
+        last_message_id = checkpoint
+
+        exporter_options = {'compression': self.arrow_compression} if exporter_type is ArrowExporter else {}
+        exporter = exporter_type(os.path.join('data', filename), append=checkpoint is not None, **exporter_options)
+        batch = []
+        count = 0
+        batches = 0
+
+        try:
+            async for message in channel.history(limit=None, after=after, oldest_first=True):
+                if wisdoms is not None:
+                    wisdoms.message_locator.remember(message)
+
+                last_message_id = message.id
+
                 try:
-                    message_data = [message.id, message.guild.name, message.channel.name, message.created_at, message.author.id, message.author.name]
-
-                    # Check to see if the user has a nickname, otherwise use their username
-                    if type(message.author) is Member and message.author.nick is not None:
-                        message_data.append(message.author.nick)
-                    else:
-                        message_data.append(message.author.name)
-
-                    # Check to see if there is any content in the message
-                    if message.content is not None:
-                        message_data.append(message.content)
-                    else:
-                        message_data.append('')
-
-                    # Check to see if the message is a reply to another message
-                    if message.reference is not None:
-                        message_data.append(message.reference.message_id)
-                    else:
-                        message_data.append('')
-
-                    writer.writerow(message_data)
+                    batch.append(self._message_row(message))
                 except Exception as e:
                     print(f'Failed to write message {message.id} to data/{filename}')
                     print(f'  Error: {e}')
+                    continue
+
+                if len(batch) >= batch_size:
+                    exporter.write_rows(batch)
+                    self.checkpoints.set(channel.id, filename, last_message_id)
+                    count += len(batch)
+                    batch = []
+
+                    batches += 1
+                    if batches % self.checkpoint_interval == 0:
+                        await self.checkpoints.save()
+
+                    print(f'  ...{count} messages from {channel.name}')
+                    if progress is not None:
+                        await progress(count)
+
+            exporter.write_rows(batch)
+            count += len(batch)
+            if last_message_id != checkpoint:
+                self.checkpoints.set(channel.id, filename, last_message_id)
+        finally:
+            exporter.close()
+
+            # Whatever made it into the export is checkpointed, even if the crawl failed part way through
+            await self.checkpoints.save()
+
+        if count:
+            print(f'Wrote {count} messages to data/{filename}')
+
+        return count
+
+    def _estimate_crawl_size(self, channel, filename, fresh):
+        ''' Estimate how much history is left to crawl in a channel
+                Message counts aren't available without crawling, so the time span between the checkpoint (or the
+                channel's creation) and the channel's last message is used instead.
+        '''
+        if channel.last_message_id is None:
+            return 0
+
+        checkpoint = None if fresh else self.checkpoints.get(channel.id, filename)
+        start = snowflake_time(checkpoint if checkpoint is not None else channel.id)
+        return max(0, (snowflake_time(channel.last_message_id) - start).total_seconds())
+
+    async def _crawl_channel(self, channel, name, export_format, fresh):
+        ''' Export a single channel, backing off and resuming if discord keeps rate limiting us '''
+        async with self._crawl_semaphore:
+            print(f'Gathering training data from {channel.name}...')
+
+            filename = f'{name}{self.exporters[export_format].extension}'
+            for attempt in range(self.max_crawl_retries):
+                checkpoint = self.checkpoints.get(channel.id, filename)
+                try:
+                    return await self.export_channel(channel, name, export_format, fresh=fresh)
+                except HTTPException as e:
+                    # discord.py already waits out rate limits on its own, so a 429 making it this far means
+                    # that the bucket is badly overloaded
+                    if e.status != 429 or attempt == self.max_crawl_retries - 1:
+                        raise
+
+                    # Once any batch has been written, retries resume from the new checkpoint instead of starting over
+                    if self.checkpoints.get(channel.id, filename) != checkpoint:
+                        fresh = False
+
+                    delay = 2 ** attempt
+                    print(f'Rate limited while gathering training data from {channel.name}, retrying in {delay} seconds')
+                    await asyncio.sleep(delay)
+
+    async def crawl(self, channels, export_format='csv', fresh=False):
+        ''' Export several channels at once
+                Channels are scheduled largest first, so the longest crawls aren't left running on their own at the
+                end. Returns the total number of messages written and the number of channels that failed.
+        '''
+        extension = self.exporters[export_format].extension
+        for channel in channels:
+            await self._move_legacy_export(channel, extension)
+
+        jobs = [(channel, self.export_name(channel)) for channel in channels]
+        jobs.sort(key=lambda job: self._estimate_crawl_size(job[0], f'{job[1]}{extension}', fresh), reverse=True)
+
+        # The semaphore is acquired in the order that tasks start running, which is the order they are created in
+        results = await asyncio.gather(*(self._crawl_channel(channel, name, export_format, fresh) for channel, name in jobs), return_exceptions=True)
+
+        count = 0
+        failures = 0
+        for (channel, _), result in zip(jobs, results):
+            if isinstance(result, Exception):
+                print(f'Failed to gather training data from {channel.name}')
+                print(f'  Error: {result}')
+                failures += 1
+            else:
+                count += result or 0
+
+        return count, failures
 
-        print(f'Wrote {len(messages)} messages to data/{filename}')
-        
     @commands.command()
-    async def gather_channel_data(self, ctx):
-        await ctx.send(f'Gathering training data from {ctx.channel.name}...')
-        messages = await self.get_channel_messages(ctx.channel)
-        await self.save_message_data_csv(messages, f'{ctx.guild.name}_{ctx.channel.name}.csv')
-        await ctx.send('Done')
+    async def gather_channel_data(self, ctx, fresh: bool = False, export_format: Literal['csv', 'arrow'] = 'csv'):
+        status = await ctx.send(f'Gathering training data from {ctx.channel.name}...')
+
+        async def progress(count):
+            await status.edit(content=f'Gathering training data from {ctx.channel.name}... ({count} messages so far)')
+
+        await self._move_legacy_export(ctx.channel, self.exporters[export_format].extension)
+        count = await self.export_channel(ctx.channel, self.export_name(ctx.channel), export_format, progress=progress, fresh=fresh)
+        await ctx.send(f'Done, gathered {count} new messages')
 
     @commands.command()
-    async def gather_guild_data(self, ctx):
+    async def gather_guild_data(self, ctx, fresh: bool = False, export_format: Literal['csv', 'arrow'] = 'csv'):
         await ctx.send(f'Gathering training data from {ctx.guild.name}...')
-        for channel in ctx.guild.text_channels:
-            print(f'Gathering training data from {channel.name}...')
-            messages = await self.get_channel_messages(channel)
-            if messages:
-                await self.save_message_data_csv(messages, f'{ctx.guild.name}_{channel.name}.csv')
-        await ctx.send('Done')
+        count, failures = await self.crawl(ctx.guild.text_channels, export_format, fresh=fresh)
+        await ctx.send(f'Done, gathered {count} new messages' + (f' ({failures} channels failed)' if failures else ''))
 
     @commands.command()
-    async def gather_all_data(self, ctx):
+    async def gather_all_data(self, ctx, fresh: bool = False, export_format: Literal['csv', 'arrow'] = 'csv'):
         await ctx.send('Gathering training data from all channels on all servers...')
-        for guild in self.bot.guilds:
-            await ctx.send(f'Gathering training data from {guild.name}...')
-            for channel in guild.text_channels:
-                try:
-                    print(f'Gathering training data from {channel.name}...')
-                    messages = await self.get_channel_messages(channel)
-                    if messages:
-                        await self.save_message_data_csv(messages, f'{guild.name}_{channel.name}.csv')
-                except Exception as e:
-                    print(f'Failed to gather training data from {channel.name}')
-                    print(f'  Error: {e}')
-        await ctx.send('Done')
\ No newline at end of file
+        channels = [channel for guild in self.bot.guilds for channel in guild.text_channels]
+        count, failures = await self.crawl(channels, export_format, fresh=fresh)
+        await ctx.send(f'Done, gathered {count} new messages' + (f' ({failures} channels failed)' if failures else ''))
\ No newline at end of file
@@ -1,6 +1,12 @@
 #!/usr/bin/env python3
 from discord.ext import commands
+from discord.utils import snowflake_time
+from collections import deque, OrderedDict
 import inspirobot
+import asyncio
+import csv
+import os
+import time
 import re
 from random import choice
 
@@ -9,16 +15,404 @@ async def setup(bot):
     await bot.add_cog(Wisdoms(bot))
 
 
+class WisdomPool:
+    ''' Pool of pre-generated wisdoms
+            Generating a wisdom is a blocking HTTP round trip to inspirobot, so wisdoms are
+            generated ahead of time on a worker thread and kept in a bounded pool.
+
+            - When the pool drops below the low watermark, a background task refills it up to the high watermark
+            - Taking a wisdom from a non-empty pool is O(1) and never waits on the network
+            - If the pool is empty, a wisdom is generated on a worker thread instead
+    '''
+
+    def __init__(self, low_watermark=2, high_watermark=5):
+        self.low_watermark = max(0, low_watermark)
+        self.high_watermark = max(1, self.low_watermark, high_watermark)
+        self._urls = deque(maxlen=self.high_watermark)
+        self._refill_task = None
+
+
+    async def _generate(self):
+        ''' Generate a single wisdom URL without blocking the event loop '''
+        wisdom = await asyncio.to_thread(inspirobot.generate)
+        return wisdom.url
+
+
+    async def _refill(self):
+        ''' Fill the pool up to the high watermark '''
+        while len(self._urls) < self.high_watermark:
+            try:
+                self._urls.append(await self._generate())
+            except Exception as e:
+                print('Failed to generate a wisdom for the wisdom pool')
+                print(f'  Error: {e}')
+                return
+
+
+    def refill(self):
+        ''' Start a background refill if one isn't already running '''
+        if self._refill_task is None or self._refill_task.done():
+            self._refill_task = asyncio.create_task(self._refill())
+
+
+    async def take(self):
+        ''' Take a wisdom URL from the pool, generating one directly if the pool is empty '''
+        if self._urls:
+            url = self._urls.popleft()
+        else:
+            url = await self._generate()
+
+        if len(self._urls) < self.low_watermark:
+            self.refill()
+
+        return url
+
+
+    def snapshot(self):
+        ''' Get the wisdom URLs that are waiting in the pool '''
+        return list(self._urls)
+
+
+    def restore(self, urls):
+        ''' Put wisdom URLs from a snapshot back into the pool '''
+        self._urls.extend(urls)
+
+
+    def close(self):
+        ''' Stop any refill that is in progress '''
+        if self._refill_task is not None:
+            self._refill_task.cancel()
+            self._refill_task = None
+
+
+class MessageLocator:
+    ''' Message ID to channel ID index
+            Finding a message by ID alone used to mean calling fetch_message on every channel
+            of every guild one at a time. This keeps a bounded LRU index of the channels that
+            recently seen messages live in, and falls back to a narrowed, concurrent search.
+
+            - Messages are remembered as they are seen by on_message and by the training data crawls
+            - Channels created after the message's snowflake timestamp, or whose last message is older than it, are skipped
+            - On a miss, at most max_concurrency fetch_message probes are in flight at once
+    '''
+
+    def __init__(self, bot, max_size=100000, max_concurrency=8):
+        self.bot = bot
+        self.max_size = max_size
+        self.max_concurrency = max_concurrency
+        self._channels = OrderedDict()
+
+
+    def remember(self, message):
+        ''' Record the channel that a message was seen in '''
+        self._channels[message.id] = message.channel.id
+        self._channels.move_to_end(message.id)
+
+        if len(self._channels) > self.max_size:
+            self._channels.popitem(last=False)
+
+
+    def snapshot(self):
+        ''' Get the indexed (message ID, channel ID) pairs, least recently used first '''
+        return list(self._channels.items())
+
+
+    def restore(self, channels):
+        ''' Index (message ID, channel ID) pairs from a snapshot '''
+        self._channels.update(channels)
+        while len(self._channels) > self.max_size:
+            self._channels.popitem(last=False)
+
+
+    def _candidate_channels(self, message_id):
+        ''' Get the channels that could possibly contain the given message '''
+        message_time = snowflake_time(message_id)
+
+        for guild in self.bot.guilds:
+            # Messages can't be older than the guild they were sent in
+            if guild.created_at > message_time:
+                continue
+
+            for channel in guild.channels:
+                if not hasattr(channel, 'fetch_message') or channel.created_at > message_time:
+                    continue
+
+                # last_message_id is None if the channel is empty or if it isn't known
+                if channel.last_message_id is not None and channel.last_message_id < message_id:
+                    continue
+
+                yield channel
+
+
+    async def _probe(self, channel, message_id, semaphore):
+        ''' Try to fetch a message from a single channel '''
+        async with semaphore:
+            try:
+                return await channel.fetch_message(message_id)
+            except Exception:
+                return None
+
+
+    async def locate(self, message_id):
+        ''' Find a message by ID, returns None if it couldn't be found '''
+        if (channel_id := self._channels.get(message_id)) is not None:
+            self._channels.move_to_end(message_id)
+
+            if channel := self.bot.get_channel(channel_id):
+                try:
+                    return await channel.fetch_message(message_id)
+                except Exception:
+                    pass
+
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+        probes = [asyncio.create_task(self._probe(channel, message_id, semaphore)) for channel in self._candidate_channels(message_id)]
+
+        try:
+            for probe in asyncio.as_completed(probes):
+                if message := await probe:
+                    self.remember(message)
+                    return message
+        finally:
+            # Stop any probes that are still waiting once the message has been found
+            for probe in probes:
+                probe.cancel()
+
+        return None
+
+
+class CooldownStore:
+    ''' Wisdom request cooldowns and thank-you obligations, indexed by user ID
+            Each user that has requested a wisdom gets a single (last request timestamp, thanked) entry.
+
+            - A user may request a wisdom once the cooldown window has passed since their last request
+            - A user must give thanks for their last wisdom before requesting another one
+            - Entries are evicted once the cooldown has passed and the user has given thanks, so memory stays flat in long running bots
+            - Unthanked entries never lapse, unless an obligation_ttl in seconds is given
+            - Entries are saved to a small CSV snapshot on a worker thread so that they survive cog reloads and restarts
+    '''
+
+    def __init__(self, filename, window=300, obligation_ttl=None, sweep_interval=300):
+        self.filename = filename
+        self.window = window
+        self.obligation_ttl = obligation_ttl
+        self.sweep_interval = sweep_interval
+        self._entries = {}
+        self._last_sweep = time.time()
+        self._save_task = None
+
+
+    def _is_expired(self, entry, now):
+        ''' Check whether an entry no longer has any effect '''
+        last_request, thanked = entry
+        if thanked:
+            return now - last_request > self.window
+        return self.obligation_ttl is not None and now - last_request > self.obligation_ttl
+
+
+    def _get(self, user_id, now):
+        ''' Get the entry for a user, evicting it if it has expired '''
+        entry = self._entries.get(user_id)
+        if entry is not None and self._is_expired(entry, now):
+            del self._entries[user_id]
+            return None
+        return entry
+
+
+    def is_cooling_down(self, user_id, now):
+        ''' Check whether a user has made a request within the cooldown window '''
+        entry = self._get(user_id, now)
+        return entry is not None and now - entry[0] <= self.window
+
+
+    def owes_thanks(self, user_id, now):
+        ''' Check whether a user still has to give thanks for their last wisdom '''
+        entry = self._get(user_id, now)
+        return entry is not None and not entry[1]
+
+
+    def record_request(self, user_id, now):
+        ''' Record that a user has been given a wisdom '''
+        self._entries[user_id] = (now, False)
+        if self.sweep(now):
+            self.save_later()
+
+
+    def record_thanks(self, user_id):
+        ''' Record that a user has given thanks for their last wisdom '''
+        if (entry := self._entries.get(user_id)) is not None and not entry[1]:
+            self._entries[user_id] = (entry[0], True)
+
+            # Save straight away, so that a restart doesn't ask the user to give thanks again
+            self.save_later()
+
+
+    def sweep(self, now, force=False):
+        ''' Evict all expired entries, at most once per sweep interval unless forced. Returns True if a sweep happened '''
+        if not force and now - self._last_sweep < self.sweep_interval:
+            return False
+
+        self._entries = {user_id: entry for user_id, entry in self._entries.items() if not self._is_expired(entry, now)}
+        self._last_sweep = now
+        return True
+
+
+    def snapshot(self):
+        ''' Get a copy of all entries '''
+        return dict(self._entries)
+
+
+    def restore(self, entries):
+        ''' Replace all entries with the ones from a snapshot '''
+        self._entries = dict(entries)
+
+
+    def load(self):
+        ''' Load entries from the snapshot file '''
+        if not os.path.exists(self.filename):
+            return
+
+        with open(self.filename, 'r') as f:
+            # The first row is the header
+            reader = csv.reader(f)
+            next(reader, None)
+            for user_id, last_request, thanked in reader:
+                self._entries[int(user_id)] = (float(last_request), thanked == '1')
+
+        self.sweep(time.time(), force=True)
+
+
+    def save(self, entries=None):
+        ''' Save entries, or a snapshot of them, to the snapshot file
+                The file is written to a temporary file first and then moved into place, so a crash can't leave a half written file behind
+        '''
+        entries = self._entries if entries is None else entries
+
+        directory = os.path.dirname(self.filename)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+
+        with open(f'{self.filename}.tmp', 'w') as f:
+            writer = csv.writer(f)
+            writer.writerow(['user_id', 'last_request', 'thanked'])
+            for user_id, (last_request, thanked) in entries.items():
+                writer.writerow([user_id, last_request, int(thanked)])
+        os.replace(f'{self.filename}.tmp', self.filename)
+
+
+    async def _save(self, previous_save, entries):
+        ''' Save a snapshot on a worker thread, after any earlier save has finished so an older snapshot never wins '''
+        if previous_save is not None:
+            await asyncio.wait([previous_save])
+
+        try:
+            await asyncio.to_thread(self.save, entries)
+        except Exception as e:
+            print('Failed to save wisdom cooldowns')
+            print(f'  Error: {e}')
+
+
+    def save_later(self):
+        ''' Save a snapshot of the entries in the background '''
+        self._save_task = asyncio.create_task(self._save(self._save_task, self.snapshot()))
+
+
+    async def close(self):
+        ''' Save a final snapshot and wait for it to be written '''
+        self.save_later()
+        await self._save_task
+
+
+class TriggerDispatcher:
+    ''' Single pass message trigger dispatcher
+            Trigger phrases and patterns are registered as data and compiled into one case
+            insensitive alternation, so a message is sorted to its handler with a single match.
+
+            - Phrases must match the whole message, patterns only need to match the start of it
+            - Capture groups in a pattern are passed to its handler as extra arguments
+            - Messages that can't start any trigger are rejected by a first character check before any regex work
+    '''
+
+    def __init__(self):
+        self._triggers = []
+        self._groups = {}
+        self._regex = None
+        self._first_chars = set()
+
+
+    def add_pattern(self, pattern, handler):
+        ''' Add a regex trigger that has to match the start of a message '''
+        self._triggers.append((pattern, handler, re.compile(pattern, re.IGNORECASE).groups))
+        self._regex = None
+
+
+    def add_phrase(self, phrase, handler):
+        ''' Add a trigger that has to match the whole message, ignoring case '''
+        self.add_pattern(re.escape(phrase) + r'\Z', handler)
+
+
+    def _compile(self):
+        ''' Combine all of the triggers into a single regex '''
+        # Each trigger gets wrapped in its own group, followed by that trigger's own groups
+        self._groups = {}
+        group_index = 1
+        for pattern, handler, group_count in self._triggers:
+            self._groups[group_index] = (handler, group_index + 1, group_index + 1 + group_count)
+            group_index += 1 + group_count
+
+        self._regex = re.compile('|'.join(f'({pattern})' for pattern, _, _ in self._triggers), re.IGNORECASE)
+
+        # Most triggers start with plain text, so the characters that a matching message can start
+        # with are known ahead of time. If any trigger starts with regex syntax, the check is skipped
+        self._first_chars = set()
+        for pattern, _, _ in self._triggers:
+            first_char = pattern[:1]
+            if not first_char.isalnum():
+                self._first_chars = None
+                break
+            self._first_chars.update((first_char.lower(), first_char.upper()))
+
+
+    def match(self, content):
+        ''' Get the handler and arguments for a message, or None if no trigger matches '''
+        if self._regex is None:
+            self._compile()
+
+        if self._first_chars is not None and content[:1] not in self._first_chars:
+            return None
+
+        if (match := self._regex.match(content)) is None:
+            return None
+
+        # The trigger's wrapping group is always the last one to close
+        handler, first_group, end_group = self._groups[match.lastindex]
+        return handler, match.groups()[first_group - 1:end_group - 1]
+
+
 class Wisdoms(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
+        self.message_locator = MessageLocator(bot)
+
+        # Wisdom pool watermarks can be configured through the environment
+        self.wisdom_pool = WisdomPool(
+            low_watermark=int(os.getenv('WISDOM_POOL_LOW', 2)),
+            high_watermark=int(os.getenv('WISDOM_POOL_HIGH', 5)),
+        )
+
         self.wisdom_strings = ['share your wisdom great one', 'what is your wisdom great one']
         self.wisdom_thanks = ['thank you for your wisdom, oh great one', 'thank you great one']
-        
-        self.wisdom_request = re.compile(r'oh great one, please respond to message (\d+) with your wisdom', re.IGNORECASE)
-        self.custom_request = re.compile(r'oh great one, please respond to message (\d+) with (.*)', re.IGNORECASE)
-        self.channel_wisdom_request = re.compile(r'oh great one, please send your wisdom to channel (\d+)', re.IGNORECASE)
-        self.channel_request = re.compile(r'oh great one, please send a message to channel (\d+) with (.*)', re.IGNORECASE)
+
+        # Triggers are checked in the order that they are added
+        self.triggers = TriggerDispatcher()
+        for phrase in self.wisdom_strings:
+            self.triggers.add_phrase(phrase, self._give_wisdom)
+        for phrase in self.wisdom_thanks:
+            self.triggers.add_phrase(phrase, self._accept_thanks)
+
+        self.triggers.add_pattern(r'oh great one, please respond to message (\d+) with your wisdom', self._respond_with_wisdom)
+        self.triggers.add_pattern(r'oh great one, please respond to message (\d+) with (.*)', self._respond_with_message)
+        self.triggers.add_pattern(r'oh great one, please send your wisdom to channel (\d+)', self._send_wisdom)
+        self.triggers.add_pattern(r'oh great one, please send a message to channel (\d+) with (.*)', self._send_message)
 
         self.patience_proverbs = [
             'Patience is the companion of wisdom.',
@@ -69,108 +463,113 @@ class Wisdoms(commands.Cog):
             'I\'m not a rock',
         ]
 
-        self.user_thanked = {}
-        self.user_last_request = {}
+        self.cooldowns = CooldownStore(os.path.join('wisdoms', 'cooldowns.csv'))
+
+    async def cog_load(self):
+        # When the cog is reloaded, the previous instance hands over its state so nothing has to be read back from disk
+        state = getattr(self.bot, 'state_handoff', {}).get(self.qualified_name)
+        if state is not None:
+            self.import_state(state)
+            del self.bot.state_handoff[self.qualified_name]
+        else:
+            # Read the cooldown snapshot off the event loop, so that the other cogs can keep loading
+            await asyncio.to_thread(self.cooldowns.load)
+
+        # Start generating wisdoms before anyone asks for them
+        self.wisdom_pool.refill()
+
+    async def cog_unload(self):
+        self.wisdom_pool.close()
+        await self.cooldowns.close()
+
+        # Hand the state over if the cog is being reloaded, now that nothing else can change it
+        if self.qualified_name in getattr(self.bot, 'state_handoff', {}):
+            self.bot.state_handoff[self.qualified_name] = self.export_state()
+
+    def export_state(self):
+        ''' Snapshot the in-memory state, for a reloaded instance of the cog to pick up with import_state '''
+        return {
+            'cooldowns': self.cooldowns.snapshot(),
+            'message_channels': self.message_locator.snapshot(),
+            'wisdoms': self.wisdom_pool.snapshot(),
+        }
+
+    def import_state(self, state):
+        ''' Pick up the state exported by a previous instance of the cog '''
+        self.cooldowns.restore(state['cooldowns'])
+        self.message_locator.restore(state['message_channels'])
+        self.wisdom_pool.restore(state['wisdoms'])
 
     @commands.Cog.listener()
     async def on_message(self, message):
-        # Check if the lower case message content is in 
-        if message.content.lower() in self.wisdom_strings:
-            # users aren't allowed to request wisdom more than once every five minutes
-            if message.author.id not in self.user_last_request or (message.created_at - self.user_last_request[message.author.id]).seconds > 300:
-                if message.author.id not in self.user_thanked or self.user_thanked[message.author.id]:
-                    self.user_thanked[message.author.id] = False
-                    self.user_last_request[message.author.id] = message.created_at
-                    wisdom = inspirobot.generate()
-                    await message.channel.send(wisdom.url)
-                else:
-                    proverb = choice(self.humility_proverbs)
-                    await message.reply(f'You didn\'t thank me for my last wisdom, young {message.author.mention}. A wise, ancient proverb says "{proverb}"')
-            else:
-                proverb = choice(self.patience_proverbs)
-                await message.reply(f'Have patience, young {message.author.mention}. A wise, ancient proverb says "{proverb}"')
-
-        elif message.content.lower() in self.wisdom_thanks:
-            self.user_thanked[message.author.id] = True
-            
-            # add "n" and "p" regional characters to the message followed by a kissing winky face
-            await message.add_reaction('🇳')
-            await message.add_reaction('🇵')
-            await message.add_reaction('😘')
-
-        elif match := self.wisdom_request.match(message.content):
-            # get the message id from the match
-            message_id = match.group(1)
-
-            await message.channel.send(f'I will try to find that message for you, young {message.author.mention}')
-            message_found = False
-
-            # Iterate over every channel in every server to try and find the message
-            for server in self.bot.guilds:
-                for channel in server.channels:
-                    try:
-                        other_message = await channel.fetch_message(message_id)
-                        wisdom = inspirobot.generate()
-                        await other_message.reply(wisdom.url)
-                        message_found = True
-                        break
-                    except Exception:
-                        continue
-
-            if not message_found:
-                await message.reply(f'I couldn\'t find that message, young {message.author.mention}')
-            else:
-                await message.reply(f'It is done, young {message.author.mention}.')
-
-        elif match := self.custom_request.match(message.content):
-            # get the message id from the match
-            message_id = match.group(1)
-
-            # get the custom message from the match
-            custom_message = match.group(2)
-
-            await message.channel.send(f'I will try to find that message for you, young {message.author.mention}')
-            message_found = False
-
-            # Iterate over every channel in every server to try and find the message
-            for server in self.bot.guilds:
-                for channel in server.channels:
-                    try:
-                        other_message = await channel.fetch_message(message_id)
-                        await other_message.reply(custom_message)
-                        message_found = True
-                        break
-                    except Exception:
-                        continue
-
-            if not message_found:
-                await message.reply(f'I couldn\'t find that message, young {message.author.mention}')
-            else:
-                await message.reply(f'It is done, young {message.author.mention}.')
+        self.message_locator.remember(message)
+
+        if trigger := self.triggers.match(message.content):
+            handler, args = trigger
+            await handler(message, *args)
 
-        elif match := self.channel_wisdom_request.match(message.content):
-            # get the channel id from the match
-            channel_id = match.group(1)
 
-            # get the channel from the id
-            if channel := self.bot.get_channel(int(channel_id)):
-                wisdom = inspirobot.generate()
-                await channel.send(wisdom.url)
-                await message.reply(f'It is done, young {message.author.mention}.')
+    async def _give_wisdom(self, message):
+        ''' Give wisdom to a user, as long as they have been patient and humble '''
+        # users aren't allowed to request wisdom more than once every five minutes
+        now = message.created_at.timestamp()
+        if not self.cooldowns.is_cooling_down(message.author.id, now):
+            if not self.cooldowns.owes_thanks(message.author.id, now):
+                self.cooldowns.record_request(message.author.id, now)
+                await message.channel.send(await self.wisdom_pool.take())
             else:
-                await message.reply(f'I couldn\'t find that channel, young {message.author.mention}')
+                proverb = choice(self.humility_proverbs)
+                await message.reply(f'You didn\'t thank me for my last wisdom, young {message.author.mention}. A wise, ancient proverb says "{proverb}"')
+        else:
+            proverb = choice(self.patience_proverbs)
+            await message.reply(f'Have patience, young {message.author.mention}. A wise, ancient proverb says "{proverb}"')
 
-        elif match := self.channel_request.match(message.content):
-            # get the channel id from the match
-            channel_id = match.group(1)
 
-            # get the custom message from the match
-            custom_message = match.group(2)
+    async def _accept_thanks(self, message):
+        ''' Accept a user's thanks for their last wisdom '''
+        self.cooldowns.record_thanks(message.author.id)
 
-            # get the channel from the id
-            if channel := self.bot.get_channel(int(channel_id)):
-                await channel.send(custom_message)
-                await message.reply(f'It is done, young {message.author.mention}.')
-            else:
-                await message.reply(f'I couldn\'t find that channel, young {message.author.mention}')
-            
\ No newline at end of file
+        # add "n" and "p" regional characters to the message followed by a kissing winky face
+        await message.add_reaction('🇳')
+        await message.add_reaction('🇵')
+        await message.add_reaction('😘')
+
+
+    async def _respond_with_wisdom(self, message, message_id):
+        ''' Reply to another message with a wisdom '''
+        await message.channel.send(f'I will try to find that message for you, young {message.author.mention}')
+
+        if other_message := await self.message_locator.locate(int(message_id)):
+            await other_message.reply(await self.wisdom_pool.take())
+            await message.reply(f'It is done, young {message.author.mention}.')
+        else:
+            await message.reply(f'I couldn\'t find that message, young {message.author.mention}')
+
+
+    async def _respond_with_message(self, message, message_id, custom_message):
+        ''' Reply to another message with a custom message '''
+        await message.channel.send(f'I will try to find that message for you, young {message.author.mention}')
+
+        if other_message := await self.message_locator.locate(int(message_id)):
+            await other_message.reply(custom_message)
+            await message.reply(f'It is done, young {message.author.mention}.')
+        else:
+            await message.reply(f'I couldn\'t find that message, young {message.author.mention}')
+
+
+    async def _send_wisdom(self, message, channel_id):
+        ''' Send a wisdom to another channel '''
+        if channel := self.bot.get_channel(int(channel_id)):
+            await channel.send(await self.wisdom_pool.take())
+            await message.reply(f'It is done, young {message.author.mention}.')
+        else:
+            await message.reply(f'I couldn\'t find that channel, young {message.author.mention}')
+
+
+    async def _send_message(self, message, channel_id, custom_message):
+        ''' Send a custom message to another channel '''
+        if channel := self.bot.get_channel(int(channel_id)):
+            await channel.send(custom_message)
+            await message.reply(f'It is done, young {message.author.mention}.')
+        else:
+            await message.reply(f'I couldn\'t find that channel, young {message.author.mention}')
@@ -6,56 +6,206 @@ from discord.ext import commands
 from dotenv import load_dotenv
 from Cogs import *
 import asyncio
+import hashlib
+import importlib
+import json
 import sys
+import time
+import tomlkit
 from getopt import getopt
 from typing import Literal
 
 # Get command line arguments
-opts, args = getopt(sys.argv[1:], '', ['beta'])
+opts, args = getopt(sys.argv[1:], '', ['beta', 'lean', 'sharded', 'shard-count=', 'shard-ids='])
 flags = [opt[0] for opt in opts if not opt[1]]
+options = {opt[0]: opt[1] for opt in opts if opt[1]}
+
+
+def parse_shard_ids(shard_ids):
+    # Shard IDs are a comma separated list of IDs and inclusive ranges, like 0,2,4-7
+    parsed = []
+    for part in shard_ids.split(','):
+        start, _, end = part.partition('-')
+        parsed.extend(range(int(start), int(end or start) + 1))
+    return parsed
+
 
 # Load environment variables
 load_dotenv()
 
+# Sharding is turned on by --sharded, or by giving an explicit shard count or shard IDs.
+# Without a shard count discord.py asks Discord how many shards to use, and runs all of them in this process.
+# Multi-process deployments give every process the same --shard-count and their own --shard-ids
+sharded = '--sharded' in flags or '--shard-count' in options or '--shard-ids' in options
+bot_options = {}
+if '--shard-count' in options:
+    bot_options['shard_count'] = int(options['--shard-count'])
+if '--shard-ids' in options:
+    if '--shard-count' not in options:
+        sys.exit('--shard-ids needs --shard-count to be given as well')
+    bot_options['shard_ids'] = parse_shard_ids(options['--shard-ids'])
+
+def extension_names():
+    return [file[:-3] for file in sorted(os.listdir('Cogs')) if not file.startswith('__') and file.endswith('.py')]
+
+
+# The intents each extension needs, kept here so that they can be worked out without importing the extensions
+EXTENSION_INTENTS = {
+    # Cogs are managed through slash commands, which don't need any intents beyond guilds
+    'cog_management': discord.Intents(guilds=True),
+    # Everything is done through interactions, which only need the guild's channels and roles to be cached
+    'game_nights': discord.Intents(guilds=True),
+    # ping is a prefix command, so it has to be able to read messages
+    'ping': discord.Intents(guilds=True, guild_messages=True, message_content=True),
+    # Crawling needs the channel list, and message content is empty without its intent, even in message history
+    'train': discord.Intents(guilds=True, guild_messages=True, message_content=True),
+    # Wisdoms are requested by sending trigger phrases in servers or direct messages
+    'wisdoms': discord.Intents(guilds=True, guild_messages=True, dm_messages=True, message_content=True),
+}
+
+
+def lean_intents():
+    # The sync command is a prefix command, so messages and their content are always needed
+    intents = discord.Intents(guilds=True, guild_messages=True, message_content=True)
+
+    # Only the extensions that will be loaded count, and one that isn't listed could need anything
+    for name in extension_names():
+        if name not in EXTENSION_INTENTS:
+            print(f'Extension {name} is not listed in EXTENSION_INTENTS, requesting all intents')
+            return discord.Intents.all()
+        intents |= EXTENSION_INTENTS[name]
+
+    return intents
+
+
+# The lean profile only requests the intents the cogs need, and doesn't cache members, presences or many messages
+if '--lean' in flags:
+    intents = lean_intents()
+    bot_options['member_cache_flags'] = discord.MemberCacheFlags.none()
+    bot_options['chunk_guilds_at_startup'] = False
+    bot_options['max_messages'] = int(os.getenv('LEAN_MAX_MESSAGES', 100))
+else:
+    intents = discord.Intents.all()
+
 # Set up bot
+bot_class = commands.AutoShardedBot if sharded else commands.Bot
 if '--beta' in flags:
     TOKEN = os.getenv('DISCORD_BETA_TOKEN')
-    bot = commands.Bot(intents=discord.Intents.all(), command_prefix='-')
+    bot = bot_class(intents=intents, command_prefix='-', **bot_options)
 else:
     TOKEN = os.getenv('DISCORD_TOKEN')
-    bot = commands.Bot(intents=discord.Intents.all(), command_prefix='ඞ')
+    bot = bot_class(intents=intents, command_prefix='ඞ', **bot_options)
 
 @bot.event
 async def on_ready():    
     print(f'\n\nLogged in as: {bot.user.name} - {bot.user.id}\nVersion: {discord.__version__}\n')
     await bot.change_presence(activity=discord.Activity(type=discord.ActivityType.watching, name="over the world from my sanctuary in the clouds"))
 
+@bot.event
+async def on_shard_ready(shard_id):
+    print(f'Shard {shard_id} is ready')
+
+# Hashes of the last command definitions synced to each scope, so that unchanged scopes don't have to be synced again
+SYNC_CACHE = os.path.join('data', 'command_sync.toml')
+SYNC_CONCURRENCY = int(os.getenv('SYNC_CONCURRENCY', 4))
+
+
+def command_tree_hash(commands_to_sync):
+    # Newer versions of discord.py need the tree to build the command payloads
+    payloads = []
+    for command in commands_to_sync:
+        try:
+            payloads.append(command.to_dict(bot.tree))
+        except TypeError:
+            payloads.append(command.to_dict())
+
+    payloads.sort(key=lambda payload: (payload.get('type', 1), payload['name']))
+    return hashlib.sha256(json.dumps(payloads, sort_keys=True).encode()).hexdigest()
+
+
+def load_sync_hashes():
+    if not os.path.exists(SYNC_CACHE):
+        return {}
+
+    with open(SYNC_CACHE, 'r') as f:
+        return tomlkit.parse(f.read()).unwrap().get(str(bot.application_id), {})
+
+
+def save_sync_hashes(hashes):
+    # Hashes are kept per application, since the beta and production bots are synced separately
+    cache = {}
+    if os.path.exists(SYNC_CACHE):
+        with open(SYNC_CACHE, 'r') as f:
+            cache = tomlkit.parse(f.read()).unwrap()
+    cache[str(bot.application_id)] = hashes
+
+    os.makedirs(os.path.dirname(SYNC_CACHE), exist_ok=True)
+    with open(f'{SYNC_CACHE}.tmp', 'w') as f:
+        f.write(tomlkit.dumps(cache))
+    os.replace(f'{SYNC_CACHE}.tmp', SYNC_CACHE)
+
+
 @bot.command()
 @commands.has_permissions(administrator=True)
-async def sync(ctx, *, mode: Literal['copy', 'nocopy', 'clear'] = 'nocopy'):
+async def sync(ctx, mode: Literal['copy', 'nocopy', 'clear'] = 'nocopy', *options: Literal['dry-run', 'force']):
     try:
-        await ctx.send('Syncing...')
-        # Sync things globally
-        synced_commands = await ctx.bot.tree.sync()
-        await ctx.send(f'Synced {len(synced_commands)} commands globally')
-
-        # Copy command tree to each guild
-        if mode == 'copy':
-            for guild in ctx.bot.guilds:
-                ctx.bot.tree.copy_global_to(guild=guild)
-                ctx.bot.tree.clear_commands(guild=guild)
-
-        if mode == 'clear':
-            for guild in ctx.bot.guilds:
-                ctx.bot.tree.clear_commands(guild=guild)
-
-        # Sync things locally
+        tree = ctx.bot.tree
+
+        # Put the commands in place for every guild, then hash what the tree actually holds, so the hashes match what gets synced
+        scopes = {'global': (None, tree.get_commands())}
+        previous_commands = {}
         for guild in ctx.bot.guilds:
-            await ctx.send(f'Attempting sync with with guild {guild.name}')
-            commands_synced = await ctx.bot.tree.sync(guild=guild)
-            await ctx.send(f'Synced {len(commands_synced)} commands with guild {guild.name}')
+            previous_commands[guild] = tree.get_commands(guild=guild)
+            if mode == 'copy':
+                tree.copy_global_to(guild=guild)
+            elif mode == 'clear':
+                tree.clear_commands(guild=guild)
+            scopes[str(guild.id)] = (guild, tree.get_commands(guild=guild))
+
+        # Only the scopes whose commands have changed since they were last synced need to be synced
+        hashes = load_sync_hashes()
+        new_hashes = {scope: command_tree_hash(scope_commands) for scope, (_, scope_commands) in scopes.items()}
+        changed = [scope for scope in scopes if 'force' in options or hashes.get(scope) != new_hashes[scope]]
+        scope_names = {scope: 'global' if guild is None else guild.name for scope, (guild, _) in scopes.items()}
+
+        if 'dry-run' in options:
+            # Put the guild commands back the way they were, since nothing is being synced
+            if mode != 'nocopy':
+                for guild, guild_commands in previous_commands.items():
+                    tree.clear_commands(guild=guild)
+                    for command in guild_commands:
+                        tree.add_command(command, guild=guild)
+
+            if changed:
+                await ctx.send(f'Would sync {len(changed)} of {len(scopes)} scopes: {", ".join(scope_names[scope] for scope in changed)}')
+            else:
+                await ctx.send(f'All {len(scopes)} scopes are up to date, nothing would be synced')
+            return
+
+        await ctx.send(f'Syncing {len(changed)} of {len(scopes)} scopes...')
 
-        await ctx.send('Sync complete')
+        # Sync the changed scopes at the same time, with a limit on how many are in flight at once to go easy on the rate limits
+        semaphore = asyncio.Semaphore(SYNC_CONCURRENCY)
+        failed = []
+
+        async def sync_scope(scope):
+            async with semaphore:
+                try:
+                    await tree.sync(guild=scopes[scope][0])
+                    hashes[scope] = new_hashes[scope]
+                except discord.HTTPException as e:
+                    print(f'Failed to sync {scope_names[scope]}: {e}')
+                    failed.append(scope_names[scope])
+
+        await asyncio.gather(*(sync_scope(scope) for scope in changed))
+
+        # Forget about guilds the bot is no longer in
+        save_sync_hashes({scope: scope_hash for scope, scope_hash in hashes.items() if scope in scopes})
+
+        if failed:
+            await ctx.send(f'Sync failed for {len(failed)} scopes: {", ".join(failed)}')
+        else:
+            await ctx.send(f'Sync complete, {len(changed)} scopes synced and {len(scopes) - len(changed)} already up to date')
     except Exception as e:
         print(e)
         
@@ -68,16 +218,42 @@ async def sync(ctx, *, mode: Literal['copy', 'nocopy', 'clear'] = 'nocopy'):
 
 
 
+# Third party modules that are slow to import, by the extension that uses them.
+# discord.py always executes an extension's module itself, so only these can be imported ahead of time on a worker thread
+HEAVY_DEPENDENCIES = {
+    'train': ['pyarrow', 'pyarrow.ipc'],
+}
+
+
+def import_dependencies(name):
+    for module in HEAVY_DEPENDENCIES.get(name, []):
+        try:
+            importlib.import_module(module)
+        except ImportError:
+            # Extensions that can run without the module report it themselves when they're loaded
+            pass
+
+
+async def load_extension(name):
+    start_time = time.perf_counter()
+
+    try:
+        await asyncio.to_thread(import_dependencies, name)
+        import_time = time.perf_counter()
+
+        await bot.load_extension(f'Cogs.{name}')
+        print(f'Loaded extension {name} in {(time.perf_counter() - start_time) * 1000:.0f} ms (dependencies {(import_time - start_time) * 1000:.0f} ms, load {(time.perf_counter() - import_time) * 1000:.0f} ms)')
+    except commands.errors.NoEntryPointError:
+        print(f'Failed to load extension {name}')
+
+
 async def main():
     async with bot:
-        for file in os.listdir('Cogs'):
-            if not file.startswith('__') and file.endswith('.py'):
-                try:
-                    print(f'Loading extension {file[:-3]}')
-                    await bot.load_extension(f'Cogs.{file[:-3]}')
-                    print('  ...Done')
-                except commands.errors.NoEntryPointError:
-                    print(f'  ...Failed to load extension {file[:-3]}')
+        # Load all of the extensions at the same time
+        start_time = time.perf_counter()
+        await asyncio.gather(*(load_extension(name) for name in extension_names()))
+        print(f'Loaded all extensions in {(time.perf_counter() - start_time) * 1000:.0f} ms')
+
         await bot.start(TOKEN)
 
 if __name__ == '__main__':
@@ -86,4 +262,14 @@ if __name__ == '__main__':
     else:
         print('Starting bot in production mode (prefix: ඞ)')
 
+    if 'shard_ids' in bot_options:
+        print(f'Running shards {", ".join(map(str, bot_options["shard_ids"]))} of {bot_options["shard_count"]}')
+    elif 'shard_count' in bot_options:
+        print(f'Running all {bot_options["shard_count"]} shards')
+    elif sharded:
+        print('Running an automatically chosen number of shards')
+
+    if '--lean' in flags:
+        print(f'Running with the lean profile (intents: {", ".join(name for name, enabled in intents if enabled)})')
+
     asyncio.run(main())